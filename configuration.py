@@ -1,10 +1,16 @@
 import sys
+import os
+import time
 import logging
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 from botocore import args
 
+DEFAULT_REGION = 'us-east-1'
+
 
 class AwsProvider:
   def __init__(self, session=None):
@@ -12,6 +18,7 @@ class AwsProvider:
     self.session = session
     self.clients = {}
     self.resources = {}
+    self.account_id = None
 
     if self.session is not None:
       self.clients['s3'] = self.session.client('s3')
@@ -19,6 +26,7 @@ class AwsProvider:
       self.clients['ec2'] = self.session.client('ec2')
       self.clients['cloudwatch'] = self.session.client('cloudwatch')
       self.clients['resourcegroupstaggingapi'] = self.session.client('resourcegroupstaggingapi')
+      self.clients['sts'] = self.session.client('sts')
       self.resources['s3'] = self.session.resource('s3')
       self.resources['ec2'] = self.session.resource('ec2')
 
@@ -28,8 +36,9 @@ class AwsProvider:
         and client_type != 'ec2'
         and client_type != 'rds'
         and client_type != 'cloudwatch'
-        and client_type != 'resourcegroupstaggingapi'):
-      raise ValueError("Client type error, valid client types are 's3', 'ec2, 'rds' and 'cloudwatch.")
+        and client_type != 'resourcegroupstaggingapi'
+        and client_type != 'sts'):
+      raise ValueError("Client type error, valid client types are 's3', 'ec2, 'rds', 'cloudwatch' and 'sts'.")
     if client_type not in self.clients.keys():
       return ValueError(f"Client type error, {client_type} not found in AWS clients")
     return self.clients[client_type]
@@ -42,6 +51,37 @@ class AwsProvider:
       return ValueError(f"Client type error, {resource_type} not found in AWS clients")
     return self.resources[resource_type]
 
+  def get_region(self):
+    """Return the region of the session."""
+    if self.session is None:
+      return None
+    return self.session.region_name
+
+  def get_account_id(self):
+    """Return the AWS account id of the session, looked up once."""
+    if self.session is None:
+      return None
+    if self.account_id is None:
+      self.account_id = self.get_client('sts').get_caller_identity()['Account']
+    return self.account_id
+
+
+class AwsProviderPool:
+  """One AwsProvider per (profile, region), created on first use."""
+  def __init__(self, session_factory=boto3.Session):
+    self.session_factory = session_factory
+    self.providers = {}
+
+  def get_provider(self, profile_name, region):
+    key = (profile_name, region)
+    if key not in self.providers:
+      if profile_name:
+        session = self.session_factory(profile_name=profile_name, region_name=region)
+      else:
+        session = self.session_factory(region_name=region)
+      self.providers[key] = AwsProvider(session=session)
+    return self.providers[key]
+
 
 class ConfigurationProvider:
   def __init__(self, s3_client, bucket_name=None, file_key=None):
@@ -94,9 +134,113 @@ class ConfigurationProvider:
       logging.error(f'Error saving configuration to S3: {e}')
 
 
+class DiscoveryCache:
+  """
+  On-disk cache for discovery results, keyed by account, region, operation and parameters.
+  Each operation has its own TTL; the oldest entries are evicted once max_entries is reached.
+  """
+  DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'synapse-cloudwatch-dashboard', 'discovery.json')
+  DEFAULT_TTLS = {
+    'ec2_instances': 15 * 60,
+    'list_metrics': 60 * 60,
+    'describe_db_instances': 60 * 60,
+    'get_resources': 60 * 60,
+  }
+  DEFAULT_TTL = 15 * 60
+
+  def __init__(self, path=DEFAULT_PATH, ttls=None, max_entries=512, refresh=False, clock=time.time):
+    self.path = path
+    self.ttls = dict(self.DEFAULT_TTLS)
+    if ttls is not None:
+      self.ttls.update(ttls)
+    self.max_entries = max_entries
+    self.refresh = refresh
+    self.clock = clock
+    # with refresh, only the entries stored before this run are ignored
+    self.created_at = clock()
+    # discovery of several regions/accounts shares the cache across threads
+    self.lock = threading.Lock()
+    self.entries = self._load()
+
+  @staticmethod
+  def make_key(account, region, operation, params):
+    return json.dumps([account, region, operation, params], sort_keys=True)
+
+  def get_ttl(self, operation):
+    return self.ttls.get(operation, self.DEFAULT_TTL)
+
+  def get_or_fetch(self, account, region, operation, params, fetch):
+    """Return the cached value for the lookup, calling fetch() and storing its result on a miss."""
+    key = self.make_key(account, region, operation, params)
+    with self.lock:
+      entry = self.entries.get(key)
+    if (entry is not None and self.clock() - entry['stored_at'] < self.get_ttl(operation)
+        and not (self.refresh and entry['stored_at'] < self.created_at)):
+      return entry['value']
+    value = fetch()
+    self.put(key, operation, value)
+    return value
+
+  def put(self, key, operation, value):
+    with self.lock:
+      self.entries[key] = {'operation': operation, 'stored_at': self.clock(), 'value': value}
+      self._evict()
+      self._save()
+
+  def _evict(self):
+    now = self.clock()
+    expired = [k for k, e in self.entries.items() if now - e['stored_at'] >= self.get_ttl(e['operation'])]
+    for k in expired:
+      del self.entries[k]
+    if len(self.entries) > self.max_entries:
+      oldest = sorted(self.entries, key=lambda k: self.entries[k]['stored_at'])
+      for k in oldest[:len(self.entries) - self.max_entries]:
+        del self.entries[k]
+
+  def _load(self):
+    if self.path is None or not os.path.exists(self.path):
+      return {}
+    try:
+      with open(self.path, 'r') as f:
+        return json.load(f)
+    except (OSError, ValueError) as e:
+      logging.warning(f'Ignoring unreadable discovery cache {self.path}: {e}')
+      return {}
+
+  def _save(self):
+    if self.path is None:
+      return
+    try:
+      os.makedirs(os.path.dirname(self.path), exist_ok=True)
+      tmp_path = f'{self.path}.tmp'
+      with open(tmp_path, 'w') as f:
+        json.dump(self.entries, f)
+      os.replace(tmp_path, self.path)
+    except OSError as e:
+      logging.error(f'Error saving discovery cache to {self.path}: {e}')
+
+
 class RealTimeConfiguration:
-  def __init__(self, aws_provider=None):
+  def __init__(self, aws_provider=None, cache=None):
     self.aws_provider = aws_provider
+    self.cache = cache
+
+  def cached(self, operation, params, fetch):
+    """Run fetch() through the discovery cache, if any."""
+    if self.cache is None:
+      return fetch()
+    account = self.aws_provider.get_account_id()
+    region = self.aws_provider.get_region()
+    return self.cache.get_or_fetch(account, region, operation, params, fetch)
+
+  def get_target(self):
+    """Return the account and region this configuration discovers resources in."""
+    return {'account': self.aws_provider.get_account_id(), 'region': self.aws_provider.get_region()}
+
+  @staticmethod
+  def get_key_prefix(target):
+    """Prefix of the configuration keys holding the resources of a non-primary account/region."""
+    return f"{target['account']}/{target['region']}/"
 
   @staticmethod
   def get_instance_from_stack_instance(stack_instance):
@@ -140,19 +284,20 @@ class RealTimeConfiguration:
     namespace = f"{namespace_prefix}-Memory-{instance}"
     return namespace
 
+  def get_cloudwatch_metric_dimension_values(self, namespace, metric_name):
+    def fetch():
+      cw_client = self.aws_provider.get_client('cloudwatch')
+      res = cw_client.list_metrics(Namespace=namespace, MetricName=metric_name)
+      return [metric["Dimensions"][0]["Value"] for metric in res["Metrics"]]
+    return self.cached('list_metrics', {'Namespace': namespace, 'MetricName': metric_name}, fetch)
+
   def get_cloudwatch_memory_instances(self, stack_instance, instance_type):
-    cw_client = self.aws_provider.get_client('cloudwatch')
     namespace = RealTimeConfiguration.get_memory_namespace(stack_instance, instance_type)
-    res = cw_client.list_metrics(Namespace=namespace, MetricName='used')
-    instances = [metric["Dimensions"][0]["Value"] for metric in res["Metrics"]]
-    return instances
+    return self.get_cloudwatch_metric_dimension_values(namespace, 'used')
 
   def get_cloudwatch_worker_stats_instances(self, stack_instance, metric_name):
-    cw_client = self.aws_provider.get_client('cloudwatch')
     namespace = self.get_worker_stats_namespace(stack_instance)
-    res = cw_client.list_metrics(Namespace=namespace, MetricName=metric_name)
-    instances = [metric["Dimensions"][0]["Value"] for metric in res["Metrics"]]
-    return instances
+    return self.get_cloudwatch_metric_dimension_values(namespace, metric_name)
 
 
   def get_cloudwatch_worker_stats_completed_job_count_instances(self, stack_instance):
@@ -166,8 +311,10 @@ class RealTimeConfiguration:
 
   def get_ec2_instance_ids(self, environment, stack, stack_instance):
     name_tag_value = f"{environment}-{stack}-{stack_instance}"
-    instances = self.get_ec2_instances_by_name(name_tag_value)
-    return [inst.id for inst in instances]
+    def fetch():
+      instances = self.get_ec2_instances_by_name(name_tag_value)
+      return [inst.id for inst in instances]
+    return self.cached('ec2_instances', {'tag:Name': name_tag_value}, fetch)
 
   def get_ec2_instances_by_name(self, name):
     ec2 = self.aws_provider.get_resource('ec2')
@@ -175,45 +322,53 @@ class RealTimeConfiguration:
     instances = ec2.instances.filter(Filters=filters)
     return instances
 
+  def get_db_instances(self):
+    """Return (DBInstanceIdentifier, DBName) pairs for all RDS instances."""
+    def fetch():
+      rds_client = self.aws_provider.get_client('rds')
+      res = rds_client.describe_db_instances()
+      return [[inst['DBInstanceIdentifier'], inst.get('DBName')] for inst in res['DBInstances']]
+    return self.cached('describe_db_instances', {}, fetch)
+
   def get_rds_instance_ids(self, stack, release_num):
-    rds_client = self.aws_provider.get_client('rds')
     db_name = f'{stack}{release_num}'
-    res = rds_client.describe_db_instances()
-    db_instances = res['DBInstances']
-    instance_ids = [inst['DBInstanceIdentifier'] for inst in db_instances if inst['DBName'] == db_name]
+    instance_ids = [inst_id for inst_id, name in self.get_db_instances() if name == db_name]
     return instance_ids
 
   def get_rds_idgen_id(self, stack):
-    rds_client = self.aws_provider.get_client('rds')
     db_name = f"{stack}idgen"
-    res = rds_client.describe_db_instances()
-    db_instances = res['DBInstances']
-    instance_ids = [inst['DBInstanceIdentifier'] for inst in db_instances if inst['DBName'] == db_name]
+    instance_ids = [inst_id for inst_id, name in self.get_db_instances() if name == db_name]
     return instance_ids[0]
 
   def get_repo_alb_name(self, stack, stack_instance):
     env_name = f'repo-{stack}-{stack_instance}'
-    rgtapi_client = aws_provider.get_client('resourcegroupstaggingapi')
     tag_filters = [{'Key':'elasticbeanstalk:environment-name', 'Values': [env_name]}]
-    resp = rgtapi_client.get_resources(
-        TagFilters=tag_filters,
-        ResourceTypeFilters = ['elasticloadbalancing:loadbalancer'],
-        IncludeComplianceDetails=False,
-        ExcludeCompliantResources=False
-    )
+    resource_type_filters = ['elasticloadbalancing:loadbalancer']
+    def fetch():
+      rgtapi_client = self.aws_provider.get_client('resourcegroupstaggingapi')
+      resp = rgtapi_client.get_resources(
+          TagFilters=tag_filters,
+          ResourceTypeFilters = resource_type_filters,
+          IncludeComplianceDetails=False,
+          ExcludeCompliantResources=False
+      )
+      return [mapping["ResourceARN"] for mapping in resp["ResourceTagMappingList"]]
+    arns = self.cached('get_resources', {'TagFilters': tag_filters, 'ResourceTypeFilters': resource_type_filters}, fetch)
     alb_name = ''
-    if resp["ResourceTagMappingList"]:
-      arn = resp["ResourceTagMappingList"][0]["ResourceARN"]
-      p = re.compile('arn:aws:elasticloadbalancing:us-east-1:\d+:loadbalancer/(.+)')
+    if arns:
+      arn = arns[0]
+      p = re.compile(r'arn:aws:elasticloadbalancing:[a-z0-9-]+:\d+:loadbalancer/(.+)')
       m = p.match(arn)
       alb_name = m.groups()[0]
     return alb_name
 
 
 class AppConfiguration:
-  def __init__(self, configuration_provider, realtime_configuration, stack, version, instances):
+  def __init__(self, configuration_provider, realtime_configuration, stack, version, instances, regional_configurations=None):
     self.configuration_provider = configuration_provider
     self.realtime_configuration = realtime_configuration
+    # additional accounts/regions, discovered in parallel with the primary one
+    self.regional_configurations = regional_configurations or []
     self.stack = stack
     self.version = version
     self.instances = instances  # instances for each environment (repo, workers, portal)
@@ -221,26 +376,25 @@ class AppConfiguration:
     if self.configuration_provider is not None:
       self.configuration = configuration_provider.load_raw_configuration()
 
-  def update_ec2_instances(self, env_type):
-    current_ec2_instances = self.realtime_configuration.get_ec2_instance_ids(env_type, self.stack, self.instances[env_type])
-    self.update_configuration_entry(f'{self.version}-{env_type}-ec2-instances', current_ec2_instances)
+  def discover_entries(self, realtime_configuration):
+    """Return the (key, values) configuration entries discovered with the given realtime configuration."""
+    entries = []
 
-  def update_configuration(self):
-    # Update EC2 instance ids
-    self.update_ec2_instances("repo")
-    self.update_ec2_instances("workers")
-    self.update_ec2_instances("portal")
+    # EC2 instance ids
+    for env_type in ["repo", "workers", "portal"]:
+      current_ec2_instances = realtime_configuration.get_ec2_instance_ids(env_type, self.stack, self.instances[env_type])
+      entries.append((f'{self.version}-{env_type}-ec2-instances', current_ec2_instances))
 
     # # Update VMids for memory
-    vm_ids = realtime_config.get_cloudwatch_memory_instances(stack_instance=self.instances['repo'], instance_type='R')
-    app_config.update_configuration_entry(key=f'{self.version}-repo-vmids', values=vm_ids)
-    vm_ids = realtime_config.get_cloudwatch_memory_instances(stack_instance=self.instances['workers'], instance_type='W')
-    app_config.update_configuration_entry(key=f'{self.version}-workers-vmids', values=vm_ids)
+    vm_ids = realtime_configuration.get_cloudwatch_memory_instances(stack_instance=self.instances['repo'], instance_type='R')
+    entries.append((f'{self.version}-repo-vmids', vm_ids))
+    vm_ids = realtime_configuration.get_cloudwatch_memory_instances(stack_instance=self.instances['workers'], instance_type='W')
+    entries.append((f'{self.version}-workers-vmids', vm_ids))
 
     # worker stats series are the same for all metric names - only need to call and save once
-    worker_names = realtime_config.get_cloudwatch_worker_stats_instances(stack_instance=self.instances['workers'],
-                                                                         metric_name='Completed Job Count')
-    app_config.update_configuration_entry(key=f'{self.version}-workers-names', values=worker_names)
+    worker_names = realtime_configuration.get_cloudwatch_worker_stats_instances(stack_instance=self.instances['workers'],
+                                                                                metric_name='Completed Job Count')
+    entries.append((f'{self.version}-workers-names', worker_names))
 
     # Docker instances are fixed and don't need to be saved here
     # SES instances are fixed and don't need to be saved here
@@ -248,8 +402,37 @@ class AppConfiguration:
     # FileScanner name format is known and does not need to be saved here
 
     # repo ALB name
-    repo_alb_name = realtime_config.get_repo_alb_name(stack=self.stack, stack_instance=self.instances['repo'])
-    app_config.update_configuration_entry(key=f'{self.version}-repo-alb-name', values=[repo_alb_name])
+    repo_alb_name = realtime_configuration.get_repo_alb_name(stack=self.stack, stack_instance=self.instances['repo'])
+    if repo_alb_name:
+      entries.append((f'{self.version}-repo-alb-name', [repo_alb_name]))
+    return entries
+
+  def update_configuration(self):
+    # The primary account/region keeps unqualified keys, the others are prefixed with <account>/<region>/
+    primary_target = self.realtime_configuration.get_target()
+    saved_primary_target = self.configuration.get('primary-target')
+    if saved_primary_target is not None and saved_primary_target != primary_target:
+      raise ValueError(f'Primary account/region {primary_target} differs from the saved one {saved_primary_target}, '
+                       f'its unqualified keys would mix resources of both')
+    self.configuration['primary-target'] = primary_target
+    sweeps = [('', self.realtime_configuration)]
+    # several profiles can resolve to the same account, each account/region is only discovered once
+    swept_targets = [primary_target]
+    for regional_configuration in self.regional_configurations:
+      target = regional_configuration.get_target()
+      if target in swept_targets:
+        logging.info(f'Skipping {target}, already discovered')
+        continue
+      swept_targets.append(target)
+      self.update_configuration_entry('discovery-targets', [target])
+      sweeps.append((RealTimeConfiguration.get_key_prefix(target), regional_configuration))
+
+    with ThreadPoolExecutor(max_workers=len(sweeps)) as executor:
+      results = list(executor.map(lambda sweep: self.discover_entries(sweep[1]), sweeps))
+
+    for (prefix, _), entries in zip(sweeps, results):
+      for key, values in entries:
+        self.update_configuration_entry(key=f'{prefix}{key}', values=values)
 
     # Save config
     self.configuration_provider.save_raw_configuration(self.configuration)
@@ -268,13 +451,22 @@ class AppConfiguration:
 
 if __name__ == '__main__':
 
-  if len(sys.argv) != 5:
-    raise ValueError('Usage: python configuration.py <stack> <stack_version> <env_instances>')
-
-  stack = sys.argv[1]
-  stack_version = sys.argv[2]
-  stack_versions_str = sys.argv[3]
-  profile_name = sys.argv[4]
+  # --refresh ignores the entries cached by previous runs, results are still stored for the next run
+  refresh = '--refresh' in sys.argv[1:]
+  # --regions=<r1,r2> discovers resources in several regions, the first one is the primary region
+  regions = [DEFAULT_REGION]
+  for arg in sys.argv[1:]:
+    if arg.startswith('--regions='):
+      regions = arg[len('--regions='):].split(',')
+  argv = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  if len(argv) != 4:
+    raise ValueError('Usage: python configuration.py <stack> <stack_version> <env_instances> <profile_name[,profile_name]> '
+                     '[--regions=<region[,region]>] [--refresh]')
+
+  stack = argv[0]
+  stack_version = argv[1]
+  stack_versions_str = argv[2]
+  profile_names = argv[3].split(',')
   stack_versions = stack_versions_str.split(',')
   env_keys = ['repo', 'workers', 'portal']
   env_instances = dict(zip(env_keys, stack_versions))
@@ -282,15 +474,18 @@ if __name__ == '__main__':
   BUCKET_NAME = f'{stack}.cloudwatch.metrics.sagebase.org'
   FILE_KEY = f'{stack}_cw_configuration.json'
 
-  session = boto3.Session(profile_name=profile_name, region_name='us-east-1')
-  aws_provider = AwsProvider(session=session)
+  provider_pool = AwsProviderPool()
+  aws_provider = provider_pool.get_provider(profile_names[0], regions[0])
   s3_client = aws_provider.get_client(client_type='s3')
   configuration_provider = ConfigurationProvider(s3_client=s3_client, bucket_name=BUCKET_NAME, file_key=FILE_KEY)
-  config = configuration_provider.load_raw_configuration()
 
-  realtime_config = RealTimeConfiguration(aws_provider=aws_provider)
+  discovery_cache = DiscoveryCache(refresh=refresh)
+  realtime_config = RealTimeConfiguration(aws_provider=aws_provider, cache=discovery_cache)
+  regional_configs = [RealTimeConfiguration(aws_provider=provider_pool.get_provider(profile_name, region), cache=discovery_cache)
+                      for profile_name in profile_names for region in regions
+                      if (profile_name, region) != (profile_names[0], regions[0])]
   app_config = AppConfiguration(configuration_provider=configuration_provider,
                                 realtime_configuration=realtime_config,
-                                stack=stack, version=stack_version, instances=env_instances)
+                                stack=stack, version=stack_version, instances=env_instances,
+                                regional_configurations=regional_configs)
   app_config.update_configuration()
-
@@ -0,0 +1,143 @@
+import sys
+import json
+import math
+
+from configuration import DEFAULT_REGION
+
+# CloudWatch dashboard quotas, and the size of the template CloudFormation accepts from S3
+DEFAULT_LIMITS = {
+  'max_body_bytes': 1000000,
+  'max_widgets': 500,
+  'max_metrics_per_widget': 500,
+  'max_metrics': 2500,
+  'max_datapoints': None,
+}
+
+# GetMetricData price, in USD per 1,000 metrics requested
+DEFAULT_PRICE_PER_1000_METRICS = 0.01
+DEFAULT_PERIOD = 300
+MAX_DATAPOINTS_PER_REQUEST = 100800
+
+
+def render_tokens(obj):
+  """Replace the unresolved pseudo parameters of a resolved dashboard body with their deploy time value."""
+  if isinstance(obj, dict):
+    if obj == {'Ref': 'AWS::Region'}:
+      return DEFAULT_REGION
+    return {k: render_tokens(v) for k, v in obj.items()}
+  if isinstance(obj, list):
+    return [render_tokens(v) for v in obj]
+  return obj
+
+
+def render_cfn_string(value):
+  """Render a resolved CloudFormation string property: a literal, or an Fn::Join of literals and pseudo parameters."""
+  if isinstance(value, dict) and 'Fn::Join' in value:
+    separator, parts = value['Fn::Join']
+    return separator.join(render_cfn_string(part) for part in parts)
+  value = render_tokens(value)
+  if not isinstance(value, str):
+    raise ValueError(f'Cannot render {value} before deployment')
+  return value
+
+
+def dashboard_body(cfn_dashboard_body):
+  """Return the dashboard body CloudWatch will receive, from the resolved DashboardBody property of the dashboard."""
+  return render_cfn_string(cfn_dashboard_body)
+
+
+def widget_budget(widget_json, interval_seconds):
+  properties = widget_json.get('properties', {})
+  widget_period = properties.get('period', DEFAULT_PERIOD)
+  # one datapoint per series covering the whole time range
+  whole_range = properties.get('setPeriodToTimeRange', False)
+  metrics = properties.get('metrics', [])
+  series = 0
+  datapoints = 0
+  requests = 0
+  for entry in metrics:
+    options = entry[-1] if entry and isinstance(entry[-1], dict) else {}
+    if 'expression' in options:
+      continue
+    series += 1
+    points = 1 if whole_range else math.ceil(interval_seconds / options.get('period', widget_period))
+    datapoints += points
+    requests += math.ceil(points / MAX_DATAPOINTS_PER_REQUEST)
+  return {
+    'title': properties.get('title', widget_json.get('type', '')),
+    'metrics': len(metrics),
+    'series': series,
+    'datapoints': datapoints,
+    'metrics_requested': requests,
+    'bytes': len(json.dumps(widget_json, separators=(',', ':'))),
+  }
+
+
+def dashboard_budget(body, interval_seconds, price_per_1000_metrics=DEFAULT_PRICE_PER_1000_METRICS):
+  """Per widget and total weight of a dashboard body (a JSON string), for one page view over interval_seconds."""
+  widgets = [widget_budget(w, interval_seconds) for w in json.loads(body).get('widgets', [])]
+  metrics_requested = sum(w['metrics_requested'] for w in widgets)
+  return {
+    'body_bytes': len(body.encode('utf-8')),
+    'widgets': widgets,
+    'metrics': sum(w['metrics'] for w in widgets),
+    'series': sum(w['series'] for w in widgets),
+    'datapoints': sum(w['datapoints'] for w in widgets),
+    'metrics_requested': metrics_requested,
+    'cost': metrics_requested * price_per_1000_metrics / 1000,
+  }
+
+
+def check_limits(budget, limits):
+  """Return a description of every exceeded limit, a limit set to None is not enforced."""
+  violations = []
+  def check(name, value, what):
+    limit = limits.get(name)
+    if limit is not None and value > limit:
+      violations.append(f'{what}: {value} > {name}={limit}')
+  check('max_body_bytes', budget['body_bytes'], 'Dashboard body size in bytes')
+  check('max_widgets', len(budget['widgets']), 'Number of widgets')
+  check('max_metrics', budget['metrics'], 'Number of metrics')
+  check('max_datapoints', budget['datapoints'], 'Datapoints per page view')
+  for w in budget['widgets']:
+    check('max_metrics_per_widget', w['metrics'], f"Metrics in widget '{w['title']}'")
+  return violations
+
+
+def format_budget(budget, top=10):
+  lines = [
+    f"Dashboard body: {budget['body_bytes']} bytes, {len(budget['widgets'])} widgets, {budget['metrics']} metrics, "
+    f"{budget['series']} series",
+    f"One page view: {budget['datapoints']} datapoints, {budget['metrics_requested']} metrics requested, "
+    f"~${budget['cost']:.4f}",
+    'Heaviest widgets:',
+  ]
+  heaviest = sorted(budget['widgets'], key=lambda w: (w['datapoints'], w['bytes']), reverse=True)[:top]
+  for w in heaviest:
+    lines.append(f"  {w['datapoints']:>10} datapoints {w['series']:>5} series {w['bytes']:>8} bytes  {w['title']}")
+  return '\n'.join(lines)
+
+
+def parse_limits(limits_context):
+  """Merge the limits given in the CDK context (a dict, or a JSON string with -c) over the defaults."""
+  limits = dict(DEFAULT_LIMITS)
+  if limits_context is None:
+    return limits
+  if isinstance(limits_context, str):
+    limits_context = json.loads(limits_context)
+  unknown = set(limits_context) - set(DEFAULT_LIMITS)
+  if unknown:
+    raise ValueError(f'Unknown dashboard budget limits {sorted(unknown)}, valid limits are {sorted(DEFAULT_LIMITS)}')
+  limits.update(limits_context)
+  return limits
+
+
+def enforce_dashboard_budget(body, interval_seconds, limits, report=False):
+  """Print the budget report if asked or if a limit is exceeded, and fail when a limit is exceeded."""
+  budget = dashboard_budget(body, interval_seconds)
+  violations = check_limits(budget, limits)
+  if report or violations:
+    print(format_budget(budget), file=sys.stderr)
+  if violations:
+    raise ValueError('Dashboard budget exceeded:\n  ' + '\n  '.join(violations))
+  return budget
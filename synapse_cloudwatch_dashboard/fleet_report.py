@@ -0,0 +1,283 @@
+import argparse
+import warnings
+
+import numpy as np
+
+from configuration import DEFAULT_REGION
+from synapse_cloudwatch_dashboard.synapse_cloudwatch_dashboard_stack import init_config, rds_ids_from_stack_versions, discovery_targets
+from synapse_cloudwatch_dashboard.metric_exporter import load_export
+
+SHARED = 'shared'
+OTHER = 'other'
+SECONDS_PER_DAY = 86400
+# a series is an outlier when it is more than OUTLIER_MADS scaled MADs, and more than
+# MIN_OUTLIER_RELATIVE_DEVIATION of the median, away from its group median
+OUTLIER_MADS = 3.5
+MAD_TO_STDDEV = 1.4826
+MIN_OUTLIER_RELATIVE_DEVIATION = 0.1
+# the MAD of smaller groups is too noisy to tell outliers apart
+MIN_OUTLIER_GROUP_SIZE = 8
+# a series is rising when its trend is significant (t-statistic of the slope) and its change over the
+# exported time range is more than RISING_MIN_RELATIVE_CHANGE of its median
+RISING_MIN_T = 3.0
+RISING_MIN_RELATIVE_CHANGE = 0.1
+# dimensions telling apart series that are different populations rather than instances of one (e.g. connection pools)
+POPULATION_DIMENSIONS = ['dataSourceId']
+
+
+'''
+  Grouping
+'''
+def series_owner_lookup(config, stack, stack_versions):
+  """
+  Map (region, namespace, dimension value) to the stack version owning the series, using the configuration keys
+  (<sv>-repo-vmids, <sv>-workers-vmids, <sv>-workers-names, <sv>-<env>-ec2-instances, <sv>-repo-alb-name),
+  the RDS ids and the names that embed the stack version (SQS query queue, CloudSearch domain).
+  (region, namespace, None) maps the namespaces that embed the stack version.
+  Stack versions of non-primary regions are reported as <sv>@<region>.
+  """
+  lookup = {}
+  targets = discovery_targets(config)
+  primary_region = targets[0]['region'] or DEFAULT_REGION
+  shared_rds_ids = set(rds_ids_from_stack_versions(stack, []))
+  for rds_id in shared_rds_ids:
+    lookup[(primary_region, 'AWS/RDS', rds_id)] = SHARED
+  for sv in stack_versions:
+    for rds_id in set(rds_ids_from_stack_versions(stack, [sv])) - shared_rds_ids:
+      lookup[(primary_region, 'AWS/RDS', rds_id)] = sv
+    lookup[(primary_region, 'AWS/SQS', f'{stack}-{sv}-QUERY')] = sv
+    lookup[(primary_region, 'AWS/CloudSearch', f'prod-{sv}-sagebase-org')] = sv
+    for namespace in [f'Repository-Database-{sv}', f'Workers-Database-{sv}', f'Asynchronous Workers - {sv}']:
+      lookup[(primary_region, namespace, None)] = sv
+  for target in targets:
+    prefix = target['prefix']
+    region = target['region'] or DEFAULT_REGION
+    for sv in stack_versions:
+      owner = sv if prefix == '' else f'{sv}@{region}'
+      for value in config.get(f'{prefix}{sv}-repo-vmids', []):
+        lookup[(region, f'Repository-Memory-{sv}', value)] = owner
+      for value in config.get(f'{prefix}{sv}-workers-vmids', []):
+        lookup[(region, f'Workers-Memory-{sv}', value)] = owner
+      for value in config.get(f'{prefix}{sv}-workers-names', []):
+        lookup[(region, f'Worker-Statistics-{sv}', value)] = owner
+      for env in ['repo', 'workers', 'portal']:
+        for value in config.get(f'{prefix}{sv}-{env}-ec2-instances', []):
+          lookup[(region, 'AWS/EC2', value)] = owner
+      for value in config.get(f'{prefix}{sv}-repo-alb-name', []):
+        lookup[(region, 'AWS/ApplicationELB', value)] = owner
+  return lookup
+
+
+def series_families(export):
+  """Metric, statistic and population of each series, only series of the same family are compared."""
+  families = []
+  for metric_name, stat, dimensions in zip(export['metric_name'], export['stat'], export['dimensions']):
+    qualifiers = [str(stat)] + [f'{d}={dimensions[d]}' for d in POPULATION_DIMENSIONS if d in dimensions]
+    families.append(f"{metric_name} ({', '.join(qualifiers)})")
+  return np.array(families, dtype=str)
+
+
+def series_owners(export, lookup):
+  # exports written before multi-region support have no region column
+  regions = export.get('region', [DEFAULT_REGION] * len(export['namespace']))
+  owners = []
+  for region, namespace, dimensions in zip(regions, export['namespace'], export['dimensions']):
+    keys = [(str(region), str(namespace), value) for value in dimensions.values()] + [(str(region), str(namespace), None)]
+    owners.append(next((lookup[key] for key in keys if key in lookup), OTHER))
+  return np.array(owners, dtype=str)
+
+
+'''
+  Statistics
+'''
+def series_statistics(timestamps, values):
+  """
+  Per series p50, p95, max, least-squares trend slope (units per day), t-statistic of the slope and change
+  over the series time span (slope x span), ignoring missing datapoints.
+  All statistics are computed over the whole (series x timestamps) matrix at once.
+  """
+  with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+    # all-NaN rows yield NaN statistics
+    warnings.simplefilter('ignore', category=RuntimeWarning)
+    p50, p95 = np.nanpercentile(values, [50, 95], axis=1)
+    vmax = np.nanmax(values, axis=1)
+
+    present = ~np.isnan(values)
+    days = np.broadcast_to((timestamps - timestamps[0]) / SECONDS_PER_DAY, values.shape)
+    n = present.sum(axis=1)
+    # centered sums, so that large values do not cancel out
+    x = np.where(present, days - np.where(present, days, 0.0).sum(axis=1, keepdims=True) / n[:, None], 0.0)
+    y = np.where(present, values - np.nanmean(values, axis=1, keepdims=True), 0.0)
+    sxx = (x * x).sum(axis=1)
+    sxy = (x * y).sum(axis=1)
+    syy = (y * y).sum(axis=1)
+    slope = np.where(sxx > 0, sxy / sxx, np.nan)
+    residual = np.maximum(syy - slope * sxy, 0.0)
+    slope_t = np.where(n > 2, slope / np.sqrt(residual / (n - 2) / sxx), np.nan)
+    span = np.nanmax(np.where(present, days, np.nan), axis=1) - np.nanmin(np.where(present, days, np.nan), axis=1)
+  return {'p50': p50, 'p95': p95, 'max': vmax, 'slope': slope, 'slope_t': slope_t, 'change': slope * span}
+
+
+def rising_series(stats, min_t=RISING_MIN_T, min_relative_change=RISING_MIN_RELATIVE_CHANGE):
+  """Whether each series has a significant upward trend, large compared to its median."""
+  with np.errstate(invalid='ignore'):
+    return ((stats['slope'] > 0) & (stats['slope_t'] >= min_t)
+            & (stats['change'] >= min_relative_change * np.abs(stats['p50'])))
+
+
+def group_extremes(group_ids, metric, num_groups, highest):
+  """Index of the series with the lowest (or highest) metric in each group, -1 if the group has no data."""
+  key = np.where(np.isnan(metric), np.inf, -metric if highest else metric)
+  order = np.lexsort((key, group_ids))
+  first = np.full(num_groups, -1)
+  starts = np.r_[0, np.flatnonzero(np.diff(group_ids[order])) + 1]
+  first[group_ids[order][starts]] = order[starts]
+  # groups where every series is missing have no extreme
+  first[np.isinf(key[first]) & (first >= 0)] = -1
+  return first
+
+
+def group_quantiles(group_ids, metric, num_groups, quantiles):
+  """
+  Linearly interpolated quantiles (one row per quantile) of the metric in each group, ignoring missing values,
+  NaN for groups without data.
+  """
+  valid = ~np.isnan(metric)
+  ids = group_ids[valid]
+  vals = metric[valid]
+  vals = vals[np.lexsort((vals, ids))]
+  counts = np.bincount(ids, minlength=num_groups)
+  starts = np.cumsum(counts) - counts
+  result = np.full((len(quantiles), num_groups), np.nan)
+  has_data = counts > 0
+  for i, q in enumerate(quantiles):
+    position = starts[has_data] + q * (counts[has_data] - 1)
+    lo = np.floor(position).astype(int)
+    hi = np.ceil(position).astype(int)
+    result[i, has_data] = vals[lo] + (position - lo) * (vals[hi] - vals[lo])
+  return result
+
+
+def group_median(group_ids, metric, num_groups):
+  """Median of the metric in each group ignoring missing values, NaN for groups without data."""
+  return group_quantiles(group_ids, metric, num_groups, [0.5])[0]
+
+
+def group_outliers(group_ids, metric, num_groups, k=OUTLIER_MADS, min_relative_deviation=MIN_OUTLIER_RELATIVE_DEVIATION):
+  """
+  Deviation of each series from its group median, and whether it is further than k scaled MADs and than
+  min_relative_deviation times the median from it.
+  Groups with fewer than MIN_OUTLIER_GROUP_SIZE series with data have no outliers.
+  """
+  median = group_median(group_ids, metric, num_groups)[group_ids]
+  deviation = metric - median
+  mad = MAD_TO_STDDEV * group_median(group_ids, np.abs(deviation), num_groups)
+  sizes = np.bincount(group_ids[~np.isnan(metric)], minlength=num_groups)
+  threshold = np.maximum(k * mad[group_ids], min_relative_deviation * np.abs(median))
+  with np.errstate(invalid='ignore'):
+    outlier = (sizes[group_ids] >= MIN_OUTLIER_GROUP_SIZE) & (np.abs(deviation) > threshold)
+  return deviation, outlier
+
+
+def group_reduce(group_ids, metric, num_groups, ufunc, initial):
+  result = np.full(num_groups, initial, dtype=float)
+  valid = ~np.isnan(metric)
+  ufunc.at(result, group_ids[valid], metric[valid])
+  result[result == initial] = np.nan
+  return result
+
+
+def fleet_report(export, owners):
+  """
+  Return one report row per (widget, family, stack version) group, sorted by widget, family then stack version.
+  A family is a metric with a statistic (and a population, see series_families).
+  """
+  if len(export['values']) == 0:
+    return []
+  stats = series_statistics(export['timestamps'], export['values'])
+  widgets, widget_ids = np.unique(export['widget'].astype(str), return_inverse=True)
+  families, family_ids = np.unique(series_families(export), return_inverse=True)
+  stack_versions, owner_ids = np.unique(owners, return_inverse=True)
+  composite_ids = (widget_ids * len(families) + family_ids) * len(stack_versions) + owner_ids
+  unique_keys, group_ids = np.unique(composite_ids, return_inverse=True)
+  num_groups = len(unique_keys)
+
+  counts = np.bincount(group_ids, minlength=num_groups)
+  # percentiles of all the datapoints of the group's series
+  num_steps = export['values'].shape[1]
+  group_p50, group_p95 = group_quantiles(np.repeat(group_ids, num_steps), export['values'].ravel(), num_groups, [0.5, 0.95])
+  group_max = group_reduce(group_ids, stats['max'], num_groups, np.maximum, -np.inf)
+  p50_deviation, p50_outlier = group_outliers(group_ids, stats['p50'], num_groups)
+  max_deviation, max_outlier = group_outliers(group_ids, stats['max'], num_groups)
+  steepest = group_extremes(group_ids, np.where(rising_series(stats), stats['slope'], np.nan), num_groups, highest=True)
+
+  # series without dimensions are named by their dashboard label
+  labels = [','.join(d.values()) or str(label) for d, label in zip(export['dimensions'], export['label'])]
+  def describe(idx, metric):
+    return (labels[idx], float(stats[metric][idx])) if idx >= 0 else None
+
+  # outliers are few, only they are visited one by one, furthest from the group median first
+  low_p50_outliers = [[] for _ in range(num_groups)]
+  low = np.flatnonzero(p50_outlier & (p50_deviation < 0))
+  for idx in low[np.argsort(p50_deviation[low])]:
+    low_p50_outliers[group_ids[idx]].append(describe(idx, 'p50'))
+  high_max_outliers = [[] for _ in range(num_groups)]
+  high = np.flatnonzero(max_outlier & (max_deviation > 0))
+  for idx in high[np.argsort(-max_deviation[high])]:
+    high_max_outliers[group_ids[idx]].append(describe(idx, 'max'))
+
+  rows = []
+  for g, key in enumerate(unique_keys):
+    rows.append({
+      'widget': str(widgets[key // len(stack_versions) // len(families)]),
+      'family': str(families[key // len(stack_versions) % len(families)]),
+      'stack_version': str(stack_versions[key % len(stack_versions)]),
+      'series': int(counts[g]),
+      'p50': float(group_p50[g]),
+      'p95': float(group_p95[g]),
+      'max': float(group_max[g]),
+      'low_p50_outliers': low_p50_outliers[g],
+      'high_max_outliers': high_max_outliers[g],
+      'steepest_slope': describe(steepest[g], 'slope'),
+    })
+  return rows
+
+
+def format_report(rows):
+  def fmt(extreme, unit=''):
+    return '-' if extreme is None else f'{extreme[0]} ({extreme[1]:.4g}{unit})'
+  def fmt_all(extremes):
+    return ', '.join(fmt(e) for e in extremes) if extremes else '-'
+  lines = []
+  widget = None
+  family = None
+  for row in rows:
+    if row['widget'] != widget:
+      widget = row['widget']
+      family = None
+      lines.append('')
+      lines.append(widget)
+    if row['family'] != family:
+      family = row['family']
+      lines.append(f'  {family}')
+    lines.append(f"    {row['stack_version']:>8}  n={row['series']:<4} p50={row['p50']:.4g} p95={row['p95']:.4g} max={row['max']:.4g}"
+                 f"  low p50 outliers: {fmt_all(row['low_p50_outliers'])}"
+                 f"  high max outliers: {fmt_all(row['high_max_outliers'])}"
+                 f"  rising: {fmt(row['steepest_slope'], '/day')}")
+  return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='Fleet health report over an exported .npz file')
+  parser.add_argument('stack')
+  parser.add_argument('stack_versions', help='comma separated list of stack versions')
+  parser.add_argument('export', help='path of a .npz file written by metric_exporter')
+  parser.add_argument('--profile', default=None)
+  args = parser.parse_args()
+
+  stack_versions = args.stack_versions.split(',')
+  config = init_config(stack=args.stack, profile_name=args.profile)
+  export = load_export(args.export)
+  owners = series_owners(export, series_owner_lookup(config, args.stack, stack_versions))
+  print(format_report(fleet_report(export, owners)))
@@ -0,0 +1,230 @@
+import sys
+import json
+import math
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from aws_cdk import App, Stack
+
+from configuration import AwsProviderPool, DEFAULT_REGION
+from synapse_cloudwatch_dashboard.synapse_cloudwatch_dashboard_stack import init_config, create_dashboard_rows
+from synapse_cloudwatch_dashboard.dashboard_budget import render_tokens
+
+# GetMetricData limits
+MAX_QUERIES_PER_REQUEST = 500
+MAX_DATAPOINTS_PER_REQUEST = 100800
+
+DEFAULT_STAT = 'Average'
+DEFAULT_PERIOD = 300
+
+
+'''
+  Series discovery
+'''
+def literal_or_none(value):
+  """Drop the values only known at deploy time, left as unresolved tokens or CloudFormation intrinsics."""
+  if not isinstance(value, str) or '${Token[' in value:
+    return None
+  return value
+
+
+def series_from_widget_json(widget_json):
+  """
+  Return the raw metric series of a rendered widget (as produced by widget.to_json()).
+  Math expressions are skipped, the metrics they use are returned like any other metric.
+  Series without an explicit region or account belong to the default region and account.
+  """
+  properties = widget_json.get('properties', {})
+  title = properties.get('title', '')
+  widget_stat = properties.get('stat', DEFAULT_STAT)
+  series = []
+  previous = []
+  for entry in properties.get('metrics', []):
+    options = entry[-1] if entry and isinstance(entry[-1], dict) else {}
+    fields = list(entry[:-1] if options else entry)
+    if 'expression' in options or not fields:
+      continue
+    # '.' repeats the value found at the same position in the previous metric
+    fields = [previous[i] if f == '.' and i < len(previous) else f for i, f in enumerate(fields)]
+    previous = fields
+    namespace, metric_name = fields[0], fields[1]
+    dimensions = dict(zip(fields[2::2], fields[3::2]))
+    series.append({
+      'widget': title,
+      'namespace': namespace,
+      'metric_name': metric_name,
+      'dimensions': dimensions,
+      'stat': options.get('stat', widget_stat),
+      'label': options.get('label', ''),
+      'region': literal_or_none(options.get('region')),
+      'account': literal_or_none(options.get('accountId')),
+    })
+  return series
+
+
+def series_from_widgets(scope, widgets):
+  """Return the distinct metric series of the widgets, in widget order, resolving their JSON through scope."""
+  seen = set()
+  series = []
+  for widget in widgets:
+    for widget_json in render_tokens(scope.resolve(widget.to_json())):
+      for s in series_from_widget_json(widget_json):
+        key = (s['namespace'], s['metric_name'], json.dumps(s['dimensions'], sort_keys=True), s['stat'], s['region'], s['account'])
+        if key in seen:
+          continue
+        seen.add(key)
+        series.append(s)
+  return series
+
+
+def metric_data_query(query_id, series, period):
+  query = {
+    'Id': query_id,
+    'MetricStat': {
+      'Metric': {
+        'Namespace': series['namespace'],
+        'MetricName': series['metric_name'],
+        'Dimensions': [{'Name': k, 'Value': v} for k, v in series['dimensions'].items()],
+      },
+      'Period': period,
+      'Stat': series['stat'],
+    },
+    'ReturnData': True,
+  }
+  if series.get('account'):
+    query['AccountId'] = series['account']
+  return query
+
+
+'''
+  Export
+'''
+def time_chunks(start_time, end_time, period, num_queries):
+  """Split [start_time, end_time) so that each request stays under the datapoints limit."""
+  points_per_query = max(1, MAX_DATAPOINTS_PER_REQUEST // num_queries)
+  chunk = timedelta(seconds=points_per_query * period)
+  chunk_start = start_time
+  while chunk_start < end_time:
+    chunk_end = min(chunk_start + chunk, end_time)
+    yield chunk_start, chunk_end
+    chunk_start = chunk_end
+
+
+def fetch_series_matrix(cw_client, series, start_time, end_time, period=DEFAULT_PERIOD):
+  """
+  Fetch the series with batched get_metric_data calls.
+  Returns (timestamps, values): epoch seconds of each period, and a (series x timestamps) float matrix,
+  NaN where CloudWatch has no datapoint.
+  """
+  num_steps = math.ceil((end_time - start_time).total_seconds() / period)
+  start_epoch = int(start_time.timestamp())
+  timestamps = start_epoch + period * np.arange(num_steps, dtype=np.int64)
+  values = np.full((len(series), num_steps), np.nan)
+
+  for batch_start in range(0, len(series), MAX_QUERIES_PER_REQUEST):
+    batch = series[batch_start:batch_start + MAX_QUERIES_PER_REQUEST]
+    queries = [metric_data_query(f'm{batch_start + i}', s, period) for i, s in enumerate(batch)]
+    for chunk_start, chunk_end in time_chunks(start_time, end_time, period, len(queries)):
+      kwargs = {
+        'MetricDataQueries': queries,
+        'StartTime': chunk_start,
+        'EndTime': chunk_end,
+        'ScanBy': 'TimestampAscending',
+      }
+      while True:
+        resp = cw_client.get_metric_data(**kwargs)
+        for result in resp['MetricDataResults']:
+          if result.get('StatusCode', 'Complete') not in ('Complete', 'PartialData'):
+            logging.warning(f"Series {result['Id']} returned status {result['StatusCode']}")
+          row = int(result['Id'][1:])
+          ts = np.array([t.timestamp() for t in result['Timestamps']], dtype=np.int64)
+          cols = (ts - start_epoch) // period
+          in_range = (cols >= 0) & (cols < num_steps)
+          values[row, cols[in_range]] = np.asarray(result['Values'], dtype=float)[in_range]
+        next_token = resp.get('NextToken')
+        if not next_token:
+          break
+        kwargs['NextToken'] = next_token
+  return timestamps, values
+
+
+def fetch_regional_series_matrix(get_cw_client, series, start_time, end_time, period=DEFAULT_PERIOD):
+  """Like fetch_series_matrix, with the series of each region fetched through get_cw_client(region)."""
+  regions = [s.get('region') or DEFAULT_REGION for s in series]
+  timestamps = None
+  values = None
+  for region in sorted(set(regions)):
+    rows = [i for i, r in enumerate(regions) if r == region]
+    timestamps, region_values = fetch_series_matrix(get_cw_client(region), [series[i] for i in rows], start_time, end_time, period)
+    if values is None:
+      values = np.full((len(series), region_values.shape[1]), np.nan)
+    values[rows] = region_values
+  if values is None:
+    return fetch_series_matrix(None, [], start_time, end_time, period)
+  return timestamps, values
+
+
+def export_series(get_cw_client, series, start_time, end_time, output_path, period=DEFAULT_PERIOD):
+  """
+  Fetch the series and write them, with a series index, to a compressed .npz file.
+  get_cw_client(region) returns the CloudWatch client to use for the series of a region.
+  """
+  timestamps, values = fetch_regional_series_matrix(get_cw_client, series, start_time, end_time, period)
+  np.savez_compressed(
+    output_path,
+    timestamps=timestamps,
+    values=values,
+    period=np.array(period),
+    widget=np.array([s['widget'] for s in series], dtype=str),
+    namespace=np.array([s['namespace'] for s in series], dtype=str),
+    metric_name=np.array([s['metric_name'] for s in series], dtype=str),
+    dimensions=np.array([json.dumps(s['dimensions'], sort_keys=True) for s in series], dtype=str),
+    stat=np.array([s['stat'] for s in series], dtype=str),
+    label=np.array([s['label'] for s in series], dtype=str),
+    region=np.array([s.get('region') or DEFAULT_REGION for s in series], dtype=str),
+    account=np.array([s.get('account') or '' for s in series], dtype=str),
+  )
+  return timestamps, values
+
+
+def load_export(path):
+  """Load an export written by export_series, dimensions are decoded back to dicts."""
+  with np.load(path) as data:
+    export = {key: data[key] for key in data.files}
+  export['dimensions'] = [json.loads(d) for d in export['dimensions']]
+  return export
+
+
+def dashboard_series(config, stack, stack_versions):
+  """Return the series shown on the dashboard for the given stack versions."""
+  rows = create_dashboard_rows(stack=stack, stack_versions=stack_versions, load_config=lambda: config)
+  widgets = [widget for row in rows for widget in row]
+  # the metrics of widget.to_json() are only plain JSON once resolved in a stack
+  return series_from_widgets(Stack(App(), 'metric-exporter'), widgets)
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='Export the dashboard series to a .npz file')
+  parser.add_argument('stack')
+  parser.add_argument('stack_versions', help='comma separated list of stack versions')
+  parser.add_argument('output', help='path of the .npz file to write')
+  parser.add_argument('--profile', default=None)
+  parser.add_argument('--days', type=int, default=35)
+  parser.add_argument('--period', type=int, default=DEFAULT_PERIOD)
+  args = parser.parse_args()
+
+  stack_versions = args.stack_versions.split(',')
+  config = init_config(stack=args.stack, profile_name=args.profile)
+  series = dashboard_series(config, args.stack, stack_versions)
+
+  provider_pool = AwsProviderPool()
+  get_cw_client = lambda region: provider_pool.get_provider(args.profile, region).get_client('cloudwatch')
+
+  now = int(datetime.now(timezone.utc).timestamp())
+  end_time = datetime.fromtimestamp(now - now % args.period, tz=timezone.utc)
+  start_time = end_time - timedelta(days=args.days)
+  export_series(get_cw_client, series, start_time, end_time, args.output, args.period)
+  print(f'Exported {len(series)} series to {args.output}', file=sys.stderr)
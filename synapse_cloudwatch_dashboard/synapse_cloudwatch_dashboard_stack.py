@@ -1,20 +1,22 @@
 import boto3
-from configuration import ConfigurationProvider, AwsProvider
+from configuration import ConfigurationProvider, AwsProvider, RealTimeConfiguration, DEFAULT_REGION
 from aws_cdk import (
     Duration,
     Stack,
     aws_cloudwatch as cw
 )
 from constructs import Construct
+from synapse_cloudwatch_dashboard.dashboard_budget import dashboard_body, enforce_dashboard_budget, parse_limits
+from synapse_cloudwatch_dashboard.synth_cache import SynthCache, code_fingerprint, configuration_slice
 
 
 def init_config(stack, profile_name):
   BUCKET_NAME = f'{stack}.cloudwatch.metrics.sagebase.org'
   FILE_KEY = f'{stack}_cw_configuration.json'
   if profile_name:
-    session = boto3.Session(profile_name=profile_name, region_name='us-east-1')
+    session = boto3.Session(profile_name=profile_name, region_name=DEFAULT_REGION)
   else:
-    session = boto3.Session(region_name='us-east-1')
+    session = boto3.Session(region_name=DEFAULT_REGION)
   aws_provider = AwsProvider(session=session)
   s3_client = aws_provider.get_client(client_type='s3')
   configuration_provider = ConfigurationProvider(s3_client=s3_client, bucket_name=BUCKET_NAME, file_key=FILE_KEY)
@@ -22,13 +24,32 @@ def init_config(stack, profile_name):
   return config
 
 
-def create_graph_widget(namespace, metric_name, dimension_name, values, title='Title', width=24, height=6):
+def discovery_targets(config):
+  """
+  Return the accounts/regions discovered by configuration.py, with the prefix of their configuration keys.
+  The primary target has no prefix and no explicit account; its region is only explicit when it is not DEFAULT_REGION.
+  """
+  primary_region = config.get('primary-target', {}).get('region')
+  if primary_region == DEFAULT_REGION:
+    primary_region = None
+  targets = [{'prefix': '', 'account': None, 'region': primary_region}]
+  for target in config.get('discovery-targets', []):
+    targets.append({'prefix': RealTimeConfiguration.get_key_prefix(target), 'account': target['account'], 'region': target['region']})
+  return targets
+
+
+def create_graph_widget(namespace, metric_name, dimension_name, values, title='Title', width=24, height=6, targets=None):
+  """targets, if given, holds the account/region of each value"""
+  if targets is None:
+    targets = [{'account': None, 'region': None}] * len(values)
   metrics = [
     cw.Metric(
       namespace=namespace,
       metric_name=metric_name,
-      dimensions_map={dimension_name: instance_id}
-    ) for instance_id in values
+      dimensions_map={dimension_name: instance_id},
+      account=target['account'],
+      region=target['region']
+    ) for instance_id, target in zip(values, targets)
   ]
   widget = cw.GraphWidget(title=title, width=width, height=height, stacked=False, left=metrics, view=cw.GraphWidgetView.TIME_SERIES)
   return widget
@@ -36,12 +57,14 @@ def create_graph_widget(namespace, metric_name, dimension_name, values, title='T
 
 def create_worker_stats_widget(title, config, stack_versions, metric_name):
   metrics = []
-  for sv in stack_versions:
-    namespace = f'Worker-Statistics-{sv}'
-    config_key = f'{sv}-workers-names'
-    version_metrics = [cw.Metric(namespace=namespace, metric_name=metric_name,
-                        dimensions_map={"Worker Name": value}) for value in config[config_key]]
-    metrics.extend(version_metrics)
+  for target in discovery_targets(config):
+    for sv in stack_versions:
+      namespace = f'Worker-Statistics-{sv}'
+      config_key = f"{target['prefix']}{sv}-workers-names"
+      version_metrics = [cw.Metric(namespace=namespace, metric_name=metric_name,
+                          dimensions_map={"Worker Name": value},
+                          account=target['account'], region=target['region']) for value in config.get(config_key, [])]
+      metrics.extend(version_metrics)
   return cw.GraphWidget(title=title, width=24, height=3,
                         view=cw.GraphWidgetView.TIME_SERIES, stacked=False, period=Duration.seconds(300),
                         left=metrics)
@@ -50,23 +73,25 @@ def create_worker_stats_widget(title, config, stack_versions, metric_name):
 def create_memory_widget(title, config, stack_versions, environment):
   ENV_KEYS = {"Repository": "repo", "Workers": "workers"}
   metrics = []
-  for sv in stack_versions:
-    namespace = f'{environment}-Memory-{sv}'
-    config_key = f'{sv}-{ENV_KEYS[environment]}-vmids'
-    version_metrics = [cw.Metric(namespace=namespace, metric_name='used',
-                        dimensions_map={"instance": value}) for value in config[config_key]]
-    metrics.extend(version_metrics)
+  for target in discovery_targets(config):
+    for sv in stack_versions:
+      namespace = f'{environment}-Memory-{sv}'
+      config_key = f"{target['prefix']}{sv}-{ENV_KEYS[environment]}-vmids"
+      version_metrics = [cw.Metric(namespace=namespace, metric_name='used',
+                          dimensions_map={"instance": value},
+                          account=target['account'], region=target['region']) for value in config.get(config_key, [])]
+      metrics.extend(version_metrics)
   return cw.GraphWidget(title=title, width=24, height=3,
                         view=cw.GraphWidgetView.TIME_SERIES, stacked=False, period=Duration.seconds(300),
                         left=metrics)
 
 
-def create_ec2_cpu_utilization_widget(title, ec2_instance_ids):
-  return create_graph_widget("AWS/EC2", "CPUUtilization", "InstanceId", ec2_instance_ids, title, 24, 6)
+def create_ec2_cpu_utilization_widget(title, ec2_instance_ids, ec2_instance_targets=None):
+  return create_graph_widget("AWS/EC2", "CPUUtilization", "InstanceId", ec2_instance_ids, title, 24, 6, ec2_instance_targets)
 
 
-def create_ec2_network_out_widget(title, ec2_instance_ids):
-  return create_graph_widget("AWS/EC2", "NetworkOut", "InstanceId", ec2_instance_ids, title, 24, 3)
+def create_ec2_network_out_widget(title, ec2_instance_ids, ec2_instance_targets=None):
+  return create_graph_widget("AWS/EC2", "NetworkOut", "InstanceId", ec2_instance_ids, title, 24, 3, ec2_instance_targets)
 
 
 '''
@@ -138,7 +163,7 @@ def create_ses_widget(title):
     metric_name="Reputation.BounceRate",
     label="Bounce Rate",
     statistic="Maximum",
-    region="us-east-1"
+    region=DEFAULT_REGION
   )
   complaint_rate_metric = cw.Metric(
     namespace="AWS/SES",
@@ -146,7 +171,7 @@ def create_ses_widget(title):
     label="Complaint Rate",
     statistic="Maximum",
     color="#d62728",
-    region="us-east-1"
+    region=DEFAULT_REGION
   )
   bounce_rate_expression = cw.MathExpression(
     expression="100 * m1",
@@ -284,19 +309,23 @@ def create_repo_alb_response_widget(title, config, stack_versions):
 def create_repo_alb_response_widget_v2(title, config, stack_versions):
   metrics = []
 
-  dimension_pairs = [(sv, dv)
+  dimension_pairs = [(target, sv, dv)
+                     for target in discovery_targets(config)
                      for sv in stack_versions
-                     if f'{sv}-repo-alb-name' in config
-                     for dv in config[f'{sv}-repo-alb-name']]
+                     if f"{target['prefix']}{sv}-repo-alb-name" in config
+                     for dv in config[f"{target['prefix']}{sv}-repo-alb-name"]]
 
-  for sv, dv in dimension_pairs:
+  for target, sv, dv in dimension_pairs:
+    label_prefix = sv if target['region'] is None else f"{sv} ({target['region']})"
     metric1 = cw.Metric(
       namespace='AWS/ApplicationELB',
       metric_name='TargetResponseTime',
       dimensions_map={'LoadBalancer': dv},
       period=Duration.seconds(300),
       statistic='Average',
-      label=f'{sv} - Average'
+      label=f'{label_prefix} - Average',
+      account=target['account'],
+      region=target['region']
     )
     metric2 = cw.Metric(
       namespace='AWS/ApplicationELB',
@@ -304,7 +333,9 @@ def create_repo_alb_response_widget_v2(title, config, stack_versions):
       dimensions_map={'LoadBalancer': dv},
       period=Duration.seconds(300),
       statistic='p95',
-      label=f'{sv} - p95'
+      label=f'{label_prefix} - p95',
+      account=target['account'],
+      region=target['region']
     )
     metrics.append(metric1)
     metrics.append(metric2)
@@ -355,7 +386,7 @@ def create_docker_cpu_widget_v2():
     metric_name="CPUUtilization",
     dimensions_map=DIMENSIONS,
     statistic="Minimum",
-    region="us-east-1"
+    region=DEFAULT_REGION
   )
   cpu_max = cpu_min.with_(statistic="Maximum")
   cpu_avg = cpu_min.with_(statistic="Average")
@@ -399,14 +430,14 @@ def create_docker_network_widget_v2():
     metric_name="NetworkRxBytes",
     dimensions_map=DIMENSIONS,
     statistic="Sum",
-    region="us-east-1"
+    region=DEFAULT_REGION
   )
   network_tx = cw.Metric(
     namespace="ECS/ContainerInsights",
     metric_name="NetworkTxBytes",
     dimensions_map=DIMENSIONS,
     statistic="Sum",
-    region="us-east-1"
+    region=DEFAULT_REGION
   )
   metrics = [network_rx, network_tx]
   widget = cw.GraphWidget(title="Docker - Network utilization", width=12, height=4, view=cw.GraphWidgetView.TIME_SERIES,
@@ -415,6 +446,215 @@ def create_docker_network_widget_v2():
   return widget
 
 
+'''
+  Widget registry
+'''
+class WidgetContext:
+  """Inputs shared by the widget factories, the configuration is only loaded when a factory asks for it."""
+  def __init__(self, stack, stack_versions, load_config):
+    self.stack = stack
+    self.stack_versions = stack_versions
+    self.load_config = load_config
+    self.config = None
+
+  def get_config(self):
+    if self.config is None:
+      self.config = self.load_config()
+    return self.config
+
+  def get_ec2_instances(self, environment):
+    """Return (instance id, account/region target) pairs of the environment, over all discovery targets."""
+    config = self.get_config()
+    return [(s, target) for target in discovery_targets(config) for sv in self.stack_versions
+            for s in config.get(f"{target['prefix']}{sv}-{environment}-ec2-instances", [])]
+
+  def get_ec2_instance_ids(self, environment):
+    return [s for s, _ in self.get_ec2_instances(environment)]
+
+  def get_ec2_instance_targets(self, environment):
+    return [target for _, target in self.get_ec2_instances(environment)]
+
+
+class WidgetFactory:
+  """A named widget, built on demand by calling build(context)."""
+  def __init__(self, name, groups, build, default=True, needs_config=False):
+    self.name = name
+    self.groups = groups
+    self.build = build
+    self.default = default
+    # whether build() reads the S3 configuration
+    self.needs_config = needs_config
+
+  def is_selected(self, selection):
+    """Default widgets are selected by name or group, other widgets only by name."""
+    if selection is None:
+      return self.default
+    if self.name in selection:
+      return True
+    return self.default and any(g in selection for g in self.groups)
+
+
+WIDGET_FACTORIES = [
+  WidgetFactory('cpu-repo', ['ec2', 'repo'],
+                lambda ctx: create_ec2_cpu_utilization_widget(title="Repo - CPU Utilization", ec2_instance_ids=ctx.get_ec2_instance_ids('repo'),
+                                                              ec2_instance_targets=ctx.get_ec2_instance_targets('repo')),
+                needs_config=True),
+  WidgetFactory('cpu-workers', ['ec2', 'workers'],
+                lambda ctx: create_ec2_cpu_utilization_widget(title="Workers - CPU Utilization", ec2_instance_ids=ctx.get_ec2_instance_ids('workers'),
+                                                              ec2_instance_targets=ctx.get_ec2_instance_targets('workers')),
+                needs_config=True),
+  WidgetFactory('rds-cpu', ['rds'],
+                lambda ctx: create_rds_cpu_utilization_widget(title='RDS - CPU Utilization', stack=ctx.stack, stack_versions=ctx.stack_versions)),
+  WidgetFactory('rds-free-storage', ['rds'],
+                lambda ctx: create_rds_free_storage_space_widget(title='RDS - Free Storage Space', stack=ctx.stack, stack_versions=ctx.stack_versions)),
+  WidgetFactory('cpu-portal', ['ec2', 'portal'],
+                lambda ctx: create_ec2_cpu_utilization_widget(title="Portal - CPU Utilization", ec2_instance_ids=ctx.get_ec2_instance_ids('portal'),
+                                                              ec2_instance_targets=ctx.get_ec2_instance_targets('portal')),
+                needs_config=True),
+  WidgetFactory('network-out-portal', ['ec2', 'portal'],
+                lambda ctx: create_ec2_network_out_widget(title="Portal - Network out", ec2_instance_ids=ctx.get_ec2_instance_ids('portal'),
+                                                          ec2_instance_targets=ctx.get_ec2_instance_targets('portal')),
+                needs_config=True),
+  WidgetFactory('docker-cpu', ['docker'], lambda ctx: create_docker_cpu_widget_v2()),
+  WidgetFactory('docker-network', ['docker'], lambda ctx: create_docker_network_widget_v2()),
+  WidgetFactory('memory-repo', ['memory', 'repo'],
+                lambda ctx: create_memory_widget(title='Repo - Memory used', config=ctx.get_config(), stack_versions=ctx.stack_versions, environment='Repository'),
+                needs_config=True),
+  WidgetFactory('memory-workers', ['memory', 'workers'],
+                lambda ctx: create_memory_widget(title='Workers - Memory used', config=ctx.get_config(), stack_versions=ctx.stack_versions, environment='Workers'),
+                needs_config=True),
+  WidgetFactory('connections-repo', ['connections', 'repo'],
+                lambda ctx: create_repo_active_connections_widget(title='Repo-Active-Connections', stack_versions=ctx.stack_versions)),
+  WidgetFactory('connections-workers', ['connections', 'workers'],
+                lambda ctx: create_workers_active_connections_widget(title='Workers-Active-Connections', stack_versions=ctx.stack_versions)),
+  WidgetFactory('worker-stats-jobs-completed', ['worker-stats', 'workers'],
+                lambda ctx: create_worker_stats_widget(title="Workers stats - Jobs completed", config=ctx.get_config(), stack_versions=ctx.stack_versions, metric_name='Completed Job Count'),
+                needs_config=True),
+  WidgetFactory('worker-stats-time-running', ['worker-stats', 'workers'],
+                lambda ctx: create_worker_stats_widget(title="Workers stats - % time running", config=ctx.get_config(), stack_versions=ctx.stack_versions, metric_name='% Time Running'),
+                needs_config=True),
+  WidgetFactory('worker-stats-cumulative-time', ['worker-stats', 'workers'],
+                lambda ctx: create_worker_stats_widget(title="Workers stats - Cumulative time", config=ctx.get_config(), stack_versions=ctx.stack_versions, metric_name='Cumulative runtime'),
+                needs_config=True),
+  WidgetFactory('query-perf', ['sqs'],
+                lambda ctx: create_query_performance_widget(title="Query Performance", stack=ctx.stack, stack_versions=ctx.stack_versions)),
+  WidgetFactory('repo-alb-v1', ['alb', 'repo'],
+                lambda ctx: create_repo_alb_response_widget(title='Repo ALB response time', config=ctx.get_config(), stack_versions=ctx.stack_versions),
+                default=False, needs_config=True),
+  WidgetFactory('repo-alb', ['alb', 'repo'],
+                lambda ctx: create_repo_alb_response_widget_v2(title='Repo ALB response time', config=ctx.get_config(), stack_versions=ctx.stack_versions),
+                needs_config=True),
+  WidgetFactory('ses', ['ses'], lambda ctx: create_ses_widget(title='SES')),
+  WidgetFactory('filescanner', ['filescanner'], lambda ctx: create_filescanner_widget(title='FileScanner', stack_versions=ctx.stack_versions)),
+  WidgetFactory('cloudsearch', ['cloudsearch'],
+                lambda ctx: create_cloudsearch_widget(title='CloudSearch - searchableDocuments', stack_versions=ctx.stack_versions)),
+  WidgetFactory('rds-read-throughput', ['rds'],
+                lambda ctx: create_rds_read_throughput_widget(title="RDS Read Throughput", stack=ctx.stack, stack_versions=ctx.stack_versions)),
+  WidgetFactory('rds-write-throughput', ['rds'],
+                lambda ctx: create_rds_write_throughput_widget(title="RDS Write Throughput", stack=ctx.stack, stack_versions=ctx.stack_versions)),
+  WidgetFactory('rds-read-latency', ['rds'],
+                lambda ctx: create_rds_read_latency_widget(title="RDS Read Latency", stack=ctx.stack, stack_versions=ctx.stack_versions)),
+  WidgetFactory('rds-write-latency', ['rds'],
+                lambda ctx: create_rds_write_latency_widget(title="RDS Write Latency", stack=ctx.stack, stack_versions=ctx.stack_versions)),
+  WidgetFactory('rds-read-iops', ['rds'],
+                lambda ctx: create_rds_read_iops_widget(title="RDS Read Iops", stack=ctx.stack, stack_versions=ctx.stack_versions)),
+  WidgetFactory('rds-write-iops', ['rds'],
+                lambda ctx: create_rds_write_iops_widget(title="RDS Write Iops", stack=ctx.stack, stack_versions=ctx.stack_versions)),
+]
+
+WIDGET_REGISTRY = {factory.name: factory for factory in WIDGET_FACTORIES}
+
+# Dashboard rows, in display order
+DASHBOARD_LAYOUT = [
+  ['cpu-repo'],
+  ['cpu-workers'],
+  ['rds-cpu'],
+  ['rds-free-storage'],
+  ['cpu-portal'],
+  ['network-out-portal'],
+  ['docker-cpu', 'docker-network'],
+  ['memory-repo'],
+  ['memory-workers'],
+  ['connections-repo'],
+  ['connections-workers'],
+  ['worker-stats-jobs-completed'],
+  ['worker-stats-time-running'],
+  ['worker-stats-cumulative-time'],
+  ['query-perf'],
+  ['repo-alb-v1'],
+  ['repo-alb'],
+  ['ses'],
+  ['filescanner'],
+  ['cloudsearch'],
+  ['rds-read-throughput', 'rds-write-throughput'],
+  ['rds-read-latency', 'rds-write-latency'],
+  ['rds-read-iops', 'rds-write-iops'],
+]
+
+
+def check_dashboard_layout(layout, factories):
+  """Every factory must be placed exactly once in the layout, otherwise it could be selected but never built."""
+  factory_names = [factory.name for factory in factories]
+  layout_names = [name for row_names in layout for name in row_names]
+  duplicates = sorted({name for name in factory_names + layout_names
+                       if factory_names.count(name) > 1 or layout_names.count(name) > 1})
+  missing = sorted(set(factory_names) - set(layout_names))
+  unknown = sorted(set(layout_names) - set(factory_names))
+  if duplicates or missing or unknown:
+    raise ValueError(f'Inconsistent dashboard layout, duplicated widgets {duplicates}, widgets missing from the layout '
+                     f'{missing}, unknown widgets in the layout {unknown}')
+
+
+check_dashboard_layout(DASHBOARD_LAYOUT, WIDGET_FACTORIES)
+
+
+def parse_widget_selection(selection_str):
+  """Parse a comma separated list of widget names and groups, None selects the default widgets."""
+  if selection_str is None:
+    return None
+  selection = {s.strip() for s in selection_str.split(',') if s.strip()}
+  if not selection:
+    raise ValueError(f"Empty widget selection '{selection_str}', omit the widgets context to build the default widgets")
+  valid = set(WIDGET_REGISTRY) | {g for factory in WIDGET_FACTORIES for g in factory.groups}
+  unknown = selection - valid
+  if unknown:
+    raise ValueError(f"Unknown widgets {sorted(unknown)}, valid names and groups are {sorted(valid)}")
+  return selection
+
+
+def selection_needs_config(selection):
+  """Whether any selected widget reads the S3 configuration."""
+  return any(WIDGET_REGISTRY[name].needs_config for row_names in DASHBOARD_LAYOUT for name in row_names
+             if WIDGET_REGISTRY[name].is_selected(selection))
+
+
+def configuration_not_loaded():
+  """load_config of a selection that does not need the configuration, a factory reading it lacks needs_config=True."""
+  raise ValueError('A selected widget reads the configuration but its WidgetFactory does not set needs_config=True')
+
+
+def create_dashboard_rows(stack, stack_versions, load_config, selection=None):
+  """Build the selected widgets, as rows in display order."""
+  context = WidgetContext(stack=stack, stack_versions=stack_versions, load_config=load_config)
+  rows = []
+  for row_names in DASHBOARD_LAYOUT:
+    row = [WIDGET_REGISTRY[name].build(context) for name in row_names if WIDGET_REGISTRY[name].is_selected(selection)]
+    if row:
+      rows.append(row)
+  return rows
+
+
+def create_cached_dashboard(scope, id, dashboard_name, cfn_dashboard_body):
+  """
+  Recreate a dashboard from the DashboardBody property of a previous synth.
+  The resource keeps the path, hence the logical id, of a cw.Dashboard created with the same id.
+  """
+  container = Construct(scope, id)
+  cfn_dashboard = cw.CfnDashboard(container, 'Resource', dashboard_name=dashboard_name, dashboard_body='{}')
+  cfn_dashboard.add_property_override('DashboardBody', cfn_dashboard_body)
+  return cfn_dashboard
+
+
 class SynapseCloudwatchDashboardStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -433,68 +673,58 @@ class SynapseCloudwatchDashboardStack(Stack):
 
       stack_versions = stack_versions_str.split(',')
 
-      dashboard = cw.Dashboard(
-        self,
-        id="stack-status",
-        dashboard_name="Stack-Status",
-        default_interval=Duration.days(35),
-      )
-
-      config = init_config(stack=stack, profile_name=profile_name)
-
-      filescanner_widget = create_filescanner_widget(title='FileScanner', stack_versions=stack_versions)
-      cloudsearch_widget = create_cloudsearch_widget(title='CloudSearch - searchableDocuments', stack_versions=stack_versions)
-      repo_active_connections_widget = create_repo_active_connections_widget(title='Repo-Active-Connections', stack_versions=stack_versions)
-      workers_active_connections_widget = create_workers_active_connections_widget(title='Workers-Active-Connections', stack_versions=stack_versions)
-      query_perf_widget = create_query_performance_widget(title="Query Performance", stack=stack, stack_versions=stack_versions)
-      ses_widget = create_ses_widget(title='SES')
-      rds_cpu_widget = create_rds_cpu_utilization_widget(title='RDS - CPU Utilization', stack=stack, stack_versions=stack_versions)
-      rds_freestorage_widget = create_rds_free_storage_space_widget(title='RDS - Free Storage Space', stack=stack, stack_versions=stack_versions)
-      repo_ec2_ids = [s for vp in stack_versions for s in config.get(f'{vp}-repo-ec2-instances', [])]
-      cpu_repo_widget = create_ec2_cpu_utilization_widget(title="Repo - CPU Utilization", ec2_instance_ids=repo_ec2_ids)
-      workers_ec2_ids = [s for vp in stack_versions for s in config.get(f'{vp}-workers-ec2-instances', [])]
-      cpu_workers_widget = create_ec2_cpu_utilization_widget(title="Workers - CPU Utilization", ec2_instance_ids=workers_ec2_ids)
-      portal_ec2_ids = [s for vp in stack_versions for s in config.get(f'{vp}-portal-ec2-instances', [])]
-      cpu_portal_widget = create_ec2_cpu_utilization_widget(title="Portal - CPU Utilization", ec2_instance_ids=portal_ec2_ids)
-      network_out_portal_widget = create_ec2_network_out_widget(title="Portal - Network out", ec2_instance_ids=portal_ec2_ids)
-      repo_memory_widget = create_memory_widget(title='Repo - Memory used', config=config, stack_versions=stack_versions, environment='Repository')
-      workers_memory_widget = create_memory_widget(title='Workers - Memory used', config=config, stack_versions=stack_versions, environment='Workers')
-      workers_jobs_completed_widget = create_worker_stats_widget(title="Workers stats - Jobs completed", config=config, stack_versions=stack_versions, metric_name='Completed Job Count')
-      workers_pc_time_widget = create_worker_stats_widget(title="Workers stats - % time running", config=config, stack_versions=stack_versions, metric_name='% Time Running')
-      workers_cumulative_time_widget = create_worker_stats_widget(title="Workers stats - Cumulative time", config=config, stack_versions=stack_versions, metric_name='Cumulative runtime')
-      repo_alb_rtime_widget = create_repo_alb_response_widget(title='Repo ALB response time', config=config, stack_versions=stack_versions)
-      repo_alb_rtime_widget2 = create_repo_alb_response_widget_v2(title='Repo ALB response time', config=config, stack_versions=stack_versions)
-      docker_cpu_widget = create_docker_cpu_widget_v2()
-      docker_network_widget = create_docker_network_widget_v2()
-      rds_read_throughput_widget = create_rds_read_throughput_widget(title="RDS Read Throughput", stack=stack, stack_versions=stack_versions)
-      rds_write_throughput_widget = create_rds_write_throughput_widget(title="RDS Write Throughput", stack=stack, stack_versions=stack_versions)
-      rds_read_latency_widget = create_rds_read_latency_widget(title="RDS Read Latency", stack=stack, stack_versions=stack_versions)
-      rds_write_latency_widget = create_rds_write_latency_widget(title="RDS Write Latency", stack=stack, stack_versions=stack_versions)
-      rds_read_iops_widget = create_rds_read_iops_widget(title="RDS Read Iops", stack=stack, stack_versions=stack_versions)
-      rds_write_iops_widget = create_rds_write_iops_widget(title="RDS Write Iops", stack=stack, stack_versions=stack_versions)
-
-      dashboard.add_widgets(cpu_repo_widget)
-      dashboard.add_widgets(cpu_workers_widget)
-      dashboard.add_widgets(rds_cpu_widget)
-      dashboard.add_widgets(rds_freestorage_widget)
-      dashboard.add_widgets(cpu_portal_widget)
-      dashboard.add_widgets(network_out_portal_widget)
-      dashboard.add_widgets(docker_cpu_widget, docker_network_widget)
-      dashboard.add_widgets(repo_memory_widget)
-      dashboard.add_widgets(workers_memory_widget)
-      dashboard.add_widgets(repo_active_connections_widget)
-      dashboard.add_widgets(workers_active_connections_widget)
-      dashboard.add_widgets(workers_jobs_completed_widget)
-      dashboard.add_widgets(workers_pc_time_widget)
-      dashboard.add_widgets(workers_cumulative_time_widget)
-      dashboard.add_widgets(query_perf_widget)
-#      dashboard.add_widgets(repo_alb_rtime_widget)
-      dashboard.add_widgets(repo_alb_rtime_widget2)
-      dashboard.add_widgets(ses_widget)
-      dashboard.add_widgets(filescanner_widget)
-      dashboard.add_widgets(cloudsearch_widget)
-      dashboard.add_widgets(rds_read_throughput_widget, rds_write_throughput_widget)
-      dashboard.add_widgets(rds_read_latency_widget, rds_write_latency_widget)
-      dashboard.add_widgets(rds_read_iops_widget, rds_write_iops_widget)
-
-
+      # Optional subset of widgets to build, e.g. -c widgets=rds,memory
+      selection = parse_widget_selection(self.node.try_get_context(key='widgets'))
+
+      # Optional dashboard budget limits, e.g. -c dashboard_budget='{"max_metrics": 1000}'
+      budget_limits = parse_limits(self.node.try_get_context(key='dashboard_budget'))
+      budget_report = str(self.node.try_get_context(key='budget_report')).lower() == 'true'
+
+      # Rendered dashboards are reused while their inputs are unchanged, -c synth_cache=false disables it
+      synth_cache = None
+      if str(self.node.try_get_context(key='synth_cache')).lower() != 'false':
+        synth_cache = SynthCache()
+
+      # The configuration is loaded from S3 only if a selected widget needs it
+      if selection_needs_config(selection):
+        config = init_config(stack=stack, profile_name=profile_name)
+        load_config = lambda: config
+      else:
+        config = {}
+        load_config = configuration_not_loaded
+
+      cache_key = SynthCache.make_key({
+        'stack': stack,
+        'stack_versions': stack_versions,
+        'profile_name': profile_name,
+        'widgets': sorted(selection) if selection is not None else None,
+        'configuration': configuration_slice(config, stack_versions),
+        'code': code_fingerprint(__file__),
+        # feature flags of cdk.json and the other context values can change the rendering
+        'context': self.node.get_all_context(),
+      })
+      cached = synth_cache.get(cache_key) if synth_cache is not None else None
+
+      default_interval = Duration.days(35)
+      if cached is not None:
+        cfn_body = cached['cfn_body']
+        create_cached_dashboard(self, id="stack-status", dashboard_name="Stack-Status", cfn_dashboard_body=cfn_body)
+      else:
+        dashboard = cw.Dashboard(
+          self,
+          id="stack-status",
+          dashboard_name="Stack-Status",
+          default_interval=default_interval,
+        )
+
+        rows = create_dashboard_rows(stack=stack, stack_versions=stack_versions, load_config=load_config, selection=selection)
+        for row in rows:
+          dashboard.add_widgets(*row)
+        cfn_body = self.resolve(dashboard.node.default_child.dashboard_body)
+
+      # Fail synth rather than ship a dashboard too heavy to load
+      body = dashboard_body(cfn_body)
+      enforce_dashboard_budget(body, default_interval.to_seconds(), budget_limits, report=budget_report)
+
+      if cached is None and synth_cache is not None:
+        synth_cache.put(cache_key, {'cfn_body': cfn_body})
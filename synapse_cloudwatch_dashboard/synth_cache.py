@@ -0,0 +1,85 @@
+import os
+import json
+import logging
+import hashlib
+from importlib import metadata
+
+import configuration
+from synapse_cloudwatch_dashboard import dashboard_budget
+
+
+def code_fingerprint(widget_module_path):
+  """
+  Hash of the widget-builder module, of the configuration keys code, of the budget body rendering code
+  and of the CDK version rendering them.
+  """
+  h = hashlib.sha256()
+  for path in [widget_module_path, configuration.__file__, dashboard_budget.__file__]:
+    with open(path, 'rb') as f:
+      h.update(f.read())
+  try:
+    h.update(metadata.version('aws-cdk-lib').encode('utf-8'))
+  except metadata.PackageNotFoundError:
+    pass
+  return h.hexdigest()
+
+
+def configuration_slice(config, stack_versions):
+  """The configuration entries the widgets of the given stack versions can read, including other regions' entries."""
+  prefixes = tuple(f'{sv}-' for sv in stack_versions)
+  return {k: v for k, v in config.items()
+          if k in ('primary-target', 'discovery-targets') or k.split('/')[-1].startswith(prefixes)}
+
+
+class SynthCache:
+  """
+  Content-addressed cache of rendered dashboard bodies, one JSON file per input hash.
+  The least recently used entries are removed once max_entries is reached.
+  """
+  DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'synapse-cloudwatch-dashboard', 'synth')
+
+  def __init__(self, path=None, max_entries=32):
+    self.path = path if path is not None else self.DEFAULT_PATH
+    self.max_entries = max_entries
+
+  @staticmethod
+  def make_key(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+  def get_entry_path(self, key):
+    return os.path.join(self.path, f'{key}.json')
+
+  def get(self, key):
+    """Return the cached value, or None on a miss."""
+    entry_path = self.get_entry_path(key)
+    if not os.path.exists(entry_path):
+      return None
+    try:
+      with open(entry_path, 'r') as f:
+        value = json.load(f)
+      # mark as recently used
+      os.utime(entry_path)
+      return value
+    except (OSError, ValueError) as e:
+      logging.warning(f'Ignoring unreadable synth cache entry {entry_path}: {e}')
+      return None
+
+  def put(self, key, value):
+    try:
+      os.makedirs(self.path, exist_ok=True)
+      entry_path = self.get_entry_path(key)
+      tmp_path = f'{entry_path}.tmp'
+      with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+      os.replace(tmp_path, entry_path)
+      self._evict()
+    except OSError as e:
+      logging.error(f'Error saving synth cache entry to {self.path}: {e}')
+
+  def _evict(self):
+    entries = [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.json')]
+    if len(entries) <= self.max_entries:
+      return
+    entries.sort(key=os.path.getmtime)
+    for entry_path in entries[:len(entries) - self.max_entries]:
+      os.remove(entry_path)
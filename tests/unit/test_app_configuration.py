@@ -0,0 +1,86 @@
+import pytest
+
+from configuration import AppConfiguration
+
+
+class StubConfigurationProvider:
+  def __init__(self, configuration=None):
+    self.configuration = configuration or {}
+    self.saved = None
+
+  def load_raw_configuration(self):
+    return self.configuration
+
+  def save_raw_configuration(self, configuration):
+    self.saved = configuration
+
+
+class StubRealTimeConfiguration:
+  """Discovers one resource of each kind, named after its account and region."""
+  def __init__(self, account, region):
+    self.account = account
+    self.region = region
+    self.sweeps = 0
+
+  def get_target(self):
+    return {'account': self.account, 'region': self.region}
+
+  def get_ec2_instance_ids(self, env_type, stack, stack_instance):
+    if env_type == 'repo':
+      self.sweeps += 1
+    return [f'i-{env_type}-{self.account}-{self.region}']
+
+  def get_cloudwatch_memory_instances(self, stack_instance, instance_type):
+    return [f'vm-{instance_type}-{self.account}-{self.region}']
+
+  def get_cloudwatch_worker_stats_instances(self, stack_instance, metric_name):
+    return [f'worker-{self.account}-{self.region}']
+
+  def get_repo_alb_name(self, stack, stack_instance):
+    return f'app/alb-{self.account}-{self.region}/1'
+
+
+def make_app_configuration(primary, regional, configuration=None):
+  provider = StubConfigurationProvider(configuration)
+  app_configuration = AppConfiguration(configuration_provider=provider, realtime_configuration=primary, stack='prod',
+                                       version='500', instances={'repo': '0', 'workers': '0', 'portal': '0'},
+                                       regional_configurations=regional)
+  return app_configuration, provider
+
+
+def test_other_targets_are_saved_under_prefixed_keys():
+  primary = StubRealTimeConfiguration('111', 'us-east-1')
+  other = StubRealTimeConfiguration('222', 'us-west-2')
+  app_configuration, provider = make_app_configuration(primary, [other])
+
+  app_configuration.update_configuration()
+
+  assert provider.saved['primary-target'] == {'account': '111', 'region': 'us-east-1'}
+  assert provider.saved['discovery-targets'] == [{'account': '222', 'region': 'us-west-2'}]
+  assert provider.saved['500-repo-ec2-instances'] == ['i-repo-111-us-east-1']
+  assert provider.saved['222/us-west-2/500-repo-ec2-instances'] == ['i-repo-222-us-west-2']
+
+
+def test_targets_already_discovered_are_skipped():
+  primary = StubRealTimeConfiguration('111', 'us-east-1')
+  # a second profile for the primary account, and two profiles for the same other account
+  same_as_primary = StubRealTimeConfiguration('111', 'us-east-1')
+  other = StubRealTimeConfiguration('222', 'us-west-2')
+  same_as_other = StubRealTimeConfiguration('222', 'us-west-2')
+  app_configuration, provider = make_app_configuration(primary, [same_as_primary, other, same_as_other])
+
+  app_configuration.update_configuration()
+
+  assert provider.saved['discovery-targets'] == [{'account': '222', 'region': 'us-west-2'}]
+  assert not any(key.startswith('111/') for key in provider.saved)
+  assert [c.sweeps for c in [primary, same_as_primary, other, same_as_other]] == [1, 0, 1, 0]
+
+
+def test_a_different_primary_target_is_rejected():
+  primary = StubRealTimeConfiguration('111', 'us-west-2')
+  app_configuration, provider = make_app_configuration(
+    primary, [], configuration={'primary-target': {'account': '111', 'region': 'us-east-1'}})
+
+  with pytest.raises(ValueError):
+    app_configuration.update_configuration()
+  assert provider.saved is None
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from configuration import DEFAULT_REGION
+from synapse_cloudwatch_dashboard.dashboard_budget import (
+  DEFAULT_LIMITS, dashboard_body, widget_budget, dashboard_budget, check_limits, parse_limits, enforce_dashboard_budget
+)
+
+DAY = 86400
+
+
+def metric_widget(metrics, **properties):
+  return {'type': 'metric', 'properties': {'title': 'widget', 'metrics': metrics, **properties}}
+
+
+def test_dashboard_body_renders_the_resolved_dashboard_body():
+  cfn_body = {'Fn::Join': ['', ['{"widgets":[{"properties":{"region":"', {'Ref': 'AWS::Region'}, '"}}]}']]}
+
+  assert dashboard_body(cfn_body) == '{"widgets":[{"properties":{"region":"' + DEFAULT_REGION + '"}}]}'
+  assert dashboard_body('{"widgets":[]}') == '{"widgets":[]}'
+  with pytest.raises(ValueError):
+    dashboard_body({'Fn::Join': ['', ['{"account":"', {'Ref': 'AWS::AccountId'}, '"}']]})
+
+
+def test_widget_budget_counts_datapoints_per_series():
+  widget = metric_widget([
+    ['AWS/EC2', 'CPUUtilization', 'InstanceId', 'i-1'],
+    ['.', '.', '.', 'i-2', {'period': 60}],
+    [{'expression': 'm1 + m2'}],
+  ], period=300)
+
+  budget = widget_budget(widget, DAY)
+
+  assert budget['metrics'] == 3
+  assert budget['series'] == 2
+  assert budget['datapoints'] == 288 + 1440
+  assert budget['metrics_requested'] == 2
+  assert budget['bytes'] == len(json.dumps(widget, separators=(',', ':')))
+
+
+def test_widget_budget_counts_one_datapoint_per_series_over_the_whole_range():
+  widget = metric_widget([['AWS/SES', 'Send'], ['AWS/SES', 'Bounce']], setPeriodToTimeRange=True)
+
+  assert widget_budget(widget, 35 * DAY)['datapoints'] == 2
+
+
+def test_widget_budget_requests_one_metric_per_datapoints_limit():
+  widget = metric_widget([['AWS/EC2', 'CPUUtilization', {'period': 1}]])
+
+  assert widget_budget(widget, 2 * DAY)['metrics_requested'] == 2
+
+
+def test_check_limits():
+  body = json.dumps({'widgets': [metric_widget([['A', 'm1'], ['A', 'm2']]), metric_widget([['A', 'm3']])]})
+  budget = dashboard_budget(body, DAY)
+  assert budget['body_bytes'] == len(body)
+  assert check_limits(budget, DEFAULT_LIMITS) == []
+
+  violations = check_limits(budget, {**DEFAULT_LIMITS, 'max_widgets': 1, 'max_metrics_per_widget': 1,
+                                     'max_datapoints': 863, 'max_body_bytes': None})
+
+  assert violations == [
+    'Number of widgets: 2 > max_widgets=1',
+    'Datapoints per page view: 864 > max_datapoints=863',
+    "Metrics in widget 'widget': 2 > max_metrics_per_widget=1",
+  ]
+  with pytest.raises(ValueError):
+    enforce_dashboard_budget(body, DAY, {**DEFAULT_LIMITS, 'max_metrics': 2})
+
+
+def test_parse_limits():
+  assert parse_limits(None) == DEFAULT_LIMITS
+  assert parse_limits('{"max_metrics": 1000}') == {**DEFAULT_LIMITS, 'max_metrics': 1000}
+  assert parse_limits({'max_datapoints': 10, 'max_body_bytes': None}) == {**DEFAULT_LIMITS, 'max_datapoints': 10,
+                                                                         'max_body_bytes': None}
+  with pytest.raises(ValueError):
+    parse_limits('{"max_metric": 1000}')
@@ -0,0 +1,154 @@
+from configuration import DiscoveryCache, RealTimeConfiguration
+
+
+class FakeClock:
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+class CountingFetch:
+  """fetch() callable returning a new value on each call."""
+  def __init__(self):
+    self.calls = 0
+
+  def __call__(self):
+    self.calls += 1
+    return [f'value-{self.calls}']
+
+
+def make_cache(tmp_path, clock, **kwargs):
+  return DiscoveryCache(path=str(tmp_path / 'discovery.json'), clock=clock, **kwargs)
+
+
+def test_entries_are_reused_until_their_ttl_expires(tmp_path):
+  clock = FakeClock()
+  cache = make_cache(tmp_path, clock, ttls={'ec2_instances': 60})
+  fetch = CountingFetch()
+
+  assert cache.get_or_fetch('111', 'us-east-1', 'ec2_instances', {'env': 'repo'}, fetch) == ['value-1']
+  clock.now += 59
+  assert cache.get_or_fetch('111', 'us-east-1', 'ec2_instances', {'env': 'repo'}, fetch) == ['value-1']
+  clock.now += 1
+  assert cache.get_or_fetch('111', 'us-east-1', 'ec2_instances', {'env': 'repo'}, fetch) == ['value-2']
+  assert fetch.calls == 2
+
+
+def test_entries_are_persisted_and_keyed_by_account_region_and_params(tmp_path):
+  clock = FakeClock()
+  fetch = CountingFetch()
+  make_cache(tmp_path, clock).get_or_fetch('111', 'us-east-1', 'list_metrics', {'ns': 'a'}, fetch)
+
+  cache = make_cache(tmp_path, clock)
+  assert cache.get_or_fetch('111', 'us-east-1', 'list_metrics', {'ns': 'a'}, fetch) == ['value-1']
+  assert cache.get_or_fetch('222', 'us-east-1', 'list_metrics', {'ns': 'a'}, fetch) == ['value-2']
+  assert cache.get_or_fetch('111', 'us-west-2', 'list_metrics', {'ns': 'a'}, fetch) == ['value-3']
+  assert cache.get_or_fetch('111', 'us-east-1', 'list_metrics', {'ns': 'b'}, fetch) == ['value-4']
+
+
+def test_oldest_entries_are_evicted_beyond_max_entries(tmp_path):
+  clock = FakeClock()
+  cache = make_cache(tmp_path, clock, max_entries=2)
+  fetch = CountingFetch()
+  for i in range(3):
+    cache.get_or_fetch('111', 'us-east-1', 'list_metrics', {'i': i}, fetch)
+    clock.now += 1
+
+  assert len(cache.entries) == 2
+  assert len(make_cache(tmp_path, clock).entries) == 2
+  # the first entry was evicted, the last two are still cached
+  assert cache.get_or_fetch('111', 'us-east-1', 'list_metrics', {'i': 2}, fetch) == ['value-3']
+  assert cache.get_or_fetch('111', 'us-east-1', 'list_metrics', {'i': 1}, fetch) == ['value-2']
+  assert cache.get_or_fetch('111', 'us-east-1', 'list_metrics', {'i': 0}, fetch) == ['value-4']
+
+
+def test_expired_entries_are_evicted_first(tmp_path):
+  clock = FakeClock()
+  cache = make_cache(tmp_path, clock, ttls={'ec2_instances': 10, 'list_metrics': 1000}, max_entries=2)
+  fetch = CountingFetch()
+  cache.get_or_fetch('111', 'us-east-1', 'list_metrics', {}, fetch)
+  cache.get_or_fetch('111', 'us-east-1', 'ec2_instances', {}, fetch)
+  clock.now += 10
+  cache.get_or_fetch('111', 'us-east-1', 'describe_db_instances', {}, fetch)
+
+  assert sorted(e['operation'] for e in cache.entries.values()) == ['describe_db_instances', 'list_metrics']
+
+
+def test_refresh_bypasses_and_rewrites_the_entries_of_previous_runs(tmp_path):
+  clock = FakeClock()
+  fetch = CountingFetch()
+  make_cache(tmp_path, clock).get_or_fetch('111', 'us-east-1', 'get_resources', {}, fetch)
+  clock.now += 1
+
+  refreshed = make_cache(tmp_path, clock, refresh=True)
+  assert refreshed.get_or_fetch('111', 'us-east-1', 'get_resources', {}, fetch) == ['value-2']
+  clock.now += 1
+  # entries stored during the refreshed run are reused by the same run
+  assert refreshed.get_or_fetch('111', 'us-east-1', 'get_resources', {}, fetch) == ['value-2']
+  assert make_cache(tmp_path, clock).get_or_fetch('111', 'us-east-1', 'get_resources', {}, fetch) == ['value-2']
+  assert fetch.calls == 2
+
+
+def test_unreadable_cache_file_is_ignored(tmp_path):
+  (tmp_path / 'discovery.json').write_text('{not json')
+  clock = FakeClock()
+  cache = make_cache(tmp_path, clock)
+  fetch = CountingFetch()
+
+  assert cache.entries == {}
+  assert cache.get_or_fetch('111', 'us-east-1', 'ec2_instances', {}, fetch) == ['value-1']
+  assert make_cache(tmp_path, clock).get_or_fetch('111', 'us-east-1', 'ec2_instances', {}, fetch) == ['value-1']
+
+
+class StubRdsClient:
+  def __init__(self):
+    self.calls = 0
+
+  def describe_db_instances(self):
+    self.calls += 1
+    return {'DBInstances': [
+      {'DBInstanceIdentifier': 'prod-500-db', 'DBName': 'prod500'},
+      {'DBInstanceIdentifier': 'prod-501-db', 'DBName': 'prod501'},
+      {'DBInstanceIdentifier': 'prod-id-generator-db', 'DBName': 'prodidgen'},
+    ]}
+
+
+class StubAwsProvider:
+  def __init__(self, account, region):
+    self.account = account
+    self.region = region
+    self.rds_client = StubRdsClient()
+
+  def get_client(self, client_type):
+    assert client_type == 'rds'
+    return self.rds_client
+
+  def get_account_id(self):
+    return self.account
+
+  def get_region(self):
+    return self.region
+
+
+def test_realtime_lookups_share_the_cache_of_a_refreshed_run(tmp_path):
+  clock = FakeClock()
+  previous_provider = StubAwsProvider('111', 'us-east-1')
+  RealTimeConfiguration(aws_provider=previous_provider, cache=make_cache(tmp_path, clock)).get_db_instances()
+  clock.now += 1
+
+  cache = make_cache(tmp_path, clock, refresh=True)
+  provider = StubAwsProvider('111', 'us-east-1')
+  other_account_provider = StubAwsProvider('222', 'us-east-1')
+  realtime_configuration = RealTimeConfiguration(aws_provider=provider, cache=cache)
+  other_realtime_configuration = RealTimeConfiguration(aws_provider=other_account_provider, cache=cache)
+
+  assert realtime_configuration.get_rds_instance_ids('prod', '500') == ['prod-500-db']
+  assert realtime_configuration.get_rds_instance_ids('prod', '501') == ['prod-501-db']
+  assert realtime_configuration.get_rds_idgen_id('prod') == 'prod-id-generator-db'
+  assert other_realtime_configuration.get_rds_instance_ids('prod', '500') == ['prod-500-db']
+
+  # the entry of the previous run is refreshed once, then reused, and accounts are cached separately
+  assert provider.rds_client.calls == 1
+  assert other_account_provider.rds_client.calls == 1
@@ -0,0 +1,131 @@
+import numpy as np
+
+from synapse_cloudwatch_dashboard.fleet_report import (
+  SECONDS_PER_DAY, MIN_OUTLIER_GROUP_SIZE, series_statistics, rising_series, group_quantiles, group_median,
+  group_extremes, group_outliers, fleet_report
+)
+
+# 35 days of 1 hour datapoints
+TIMESTAMPS = np.arange(35 * 24, dtype=np.int64) * 3600
+DAYS = TIMESTAMPS / SECONDS_PER_DAY
+
+
+def test_series_statistics_ignore_missing_datapoints():
+  values = np.vstack([
+    np.linspace(0, 100, len(TIMESTAMPS)),
+    np.full(len(TIMESTAMPS), 7.0),
+    np.full(len(TIMESTAMPS), np.nan),
+  ])
+  values[0, ::2] = np.nan
+
+  stats = series_statistics(TIMESTAMPS, values)
+
+  present = values[0, 1::2]
+  np.testing.assert_allclose(stats['p50'][:2], [np.percentile(present, 50), 7.0])
+  np.testing.assert_allclose(stats['p95'][:2], [np.percentile(present, 95), 7.0])
+  np.testing.assert_allclose(stats['max'][:2], [present.max(), 7.0])
+  np.testing.assert_allclose(stats['slope'][0], 100 / DAYS[-1])
+  np.testing.assert_allclose(stats['change'][0], 100 / DAYS[-1] * (DAYS[-1] - DAYS[1]))
+  assert stats['slope'][1] == 0
+  assert np.isnan(stats['slope'][2]) and np.isnan(stats['p50'][2])
+
+
+def test_slope_of_large_values_is_not_lost_to_cancellation():
+  values = (1e12 + 10 * DAYS)[None, :] + np.tile([0.0, 1.0], len(TIMESTAMPS) // 2)
+
+  stats = series_statistics(TIMESTAMPS, values)
+
+  np.testing.assert_allclose(stats['slope'], [10], rtol=1e-3)
+  assert stats['slope_t'][0] > 100
+
+
+def test_only_significant_and_large_trends_are_rising():
+  rng = np.random.default_rng(0)
+  noise = rng.normal(50, 1, (200, len(TIMESTAMPS)))
+  trend = 50 + 10 * DAYS / DAYS[-1] + rng.normal(0, 1, len(TIMESTAMPS))
+  small_trend = 50 + 0.01 * DAYS + rng.normal(0, 0.01, len(TIMESTAMPS))
+
+  rising = rising_series(series_statistics(TIMESTAMPS, np.vstack([noise, trend, small_trend])))
+
+  assert not rising[:200].any()
+  assert rising[200]
+  # significant, but less than 10% of the median over the time range
+  assert not rising[201]
+
+
+def test_group_quantiles_and_median():
+  group_ids = np.array([0, 1, 0, 1, 0, 2, 0])
+  metric = np.array([4.0, 10.0, 1.0, np.nan, 3.0, np.nan, 2.0])
+
+  quantiles = group_quantiles(group_ids, metric, 4, [0.5, 0.95])
+
+  np.testing.assert_allclose(quantiles[:, 0], np.percentile([1.0, 2.0, 3.0, 4.0], [50, 95]))
+  np.testing.assert_allclose(quantiles[:, 1], [10.0, 10.0])
+  assert np.isnan(quantiles[:, 2:]).all()
+  np.testing.assert_allclose(group_median(group_ids, metric, 4), [2.5, 10.0, np.nan, np.nan])
+
+
+def test_group_extremes():
+  group_ids = np.array([1, 0, 1, 0, 2, 1])
+  metric = np.array([5.0, 2.0, 9.0, 3.0, np.nan, np.nan])
+
+  np.testing.assert_array_equal(group_extremes(group_ids, metric, 4, highest=True), [3, 2, -1, -1])
+  np.testing.assert_array_equal(group_extremes(group_ids, metric, 4, highest=False), [1, 0, -1, -1])
+
+
+def test_group_outliers():
+  inliers = [50.0, 51.0, 49.0, 50.5, 49.5, 50.0, 50.2]
+  metric = np.array(inliers + [80.0] + inliers + [54.0] + [50.0, 80.0, 49.0])
+  group_ids = np.repeat([0, 1, 2], [8, 8, 3])
+
+  deviation, outlier = group_outliers(group_ids, metric, 3)
+
+  assert MIN_OUTLIER_GROUP_SIZE == 8
+  np.testing.assert_allclose(deviation[7], 80.0 - 50.1)
+  # the series at 54 is many MADs away but within 10% of the median, the last group is too small
+  np.testing.assert_array_equal(np.flatnonzero(outlier), [7])
+
+
+def test_fleet_report_groups_by_widget_family_and_owner():
+  num_steps = len(TIMESTAMPS)
+  values = np.vstack([np.full(num_steps, v) for v in [1.0, 2.0, 3.0, 100.0, 200.0, 300.0]])
+  export = {
+    'timestamps': TIMESTAMPS,
+    'values': values,
+    'widget': np.array(['Connections'] * 3 + ['SES'] * 3),
+    'metric_name': np.array(['activeConnectionsCount'] * 3 + ['Bounce', 'Send', 'Send']),
+    'stat': np.array(['Maximum'] * 3 + ['Sum'] * 3),
+    'dimensions': [{'dataSourceId': 'idgen'}, {'dataSourceId': 'main'}, {'dataSourceId': 'main'}, {}, {}, {}],
+    'label': np.array(['', '', '', 'Bounced Count', 'Sent Count', 'Sent Count']),
+  }
+  owners = np.array(['500', '500', '501', '500', '500', '501'])
+
+  rows = fleet_report(export, owners)
+
+  assert [(r['widget'], r['family'], r['stack_version'], r['series'], r['max']) for r in rows] == [
+    ('Connections', 'activeConnectionsCount (Maximum, dataSourceId=idgen)', '500', 1, 1.0),
+    ('Connections', 'activeConnectionsCount (Maximum, dataSourceId=main)', '500', 1, 2.0),
+    ('Connections', 'activeConnectionsCount (Maximum, dataSourceId=main)', '501', 1, 3.0),
+    ('SES', 'Bounce (Sum)', '500', 1, 100.0),
+    ('SES', 'Send (Sum)', '500', 1, 200.0),
+    ('SES', 'Send (Sum)', '501', 1, 300.0),
+  ]
+  assert all(r['steepest_slope'] is None for r in rows)
+
+
+def test_fleet_report_percentiles_pool_the_datapoints_of_the_group():
+  values = np.vstack([np.arange(100, dtype=float), 100 + 2 * np.arange(100, dtype=float)])
+  export = {
+    'timestamps': TIMESTAMPS[:100],
+    'values': values,
+    'widget': np.array(['Repo - Memory used'] * 2),
+    'metric_name': np.array(['used'] * 2),
+    'stat': np.array(['Average'] * 2),
+    'dimensions': [{'instance': 'vm1'}, {'instance': 'vm2'}],
+    'label': np.array(['', '']),
+  }
+
+  [row] = fleet_report(export, np.array(['500', '500']))
+
+  np.testing.assert_allclose([row['p50'], row['p95'], row['max']], np.percentile(values, [50, 95, 100]))
+  assert row['steepest_slope'][0] == 'vm2'
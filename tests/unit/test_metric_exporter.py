@@ -0,0 +1,142 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from synapse_cloudwatch_dashboard.metric_exporter import (
+  MAX_QUERIES_PER_REQUEST, MAX_DATAPOINTS_PER_REQUEST, fetch_series_matrix, fetch_regional_series_matrix, export_series,
+  load_export
+)
+
+START_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class StubCloudWatchClient:
+  """
+  get_metric_data stub enforcing the request limits, returning at most page_size results per page.
+  The value of series i at time t is i * 1000000 + (t - START_TIME) / period.
+  """
+  def __init__(self, region='us-east-1', page_size=None):
+    self.region = region
+    self.page_size = page_size
+    self.calls = []
+
+  def get_metric_data(self, MetricDataQueries, StartTime, EndTime, ScanBy, NextToken=None):
+    period = MetricDataQueries[0]['MetricStat']['Period']
+    num_steps = math.ceil((EndTime - StartTime).total_seconds() / period)
+    assert len(MetricDataQueries) <= MAX_QUERIES_PER_REQUEST
+    assert len(MetricDataQueries) * num_steps <= MAX_DATAPOINTS_PER_REQUEST
+    self.calls.append({'queries': MetricDataQueries, 'start': StartTime, 'end': EndTime, 'next_token': NextToken})
+
+    results = []
+    for query in MetricDataQueries:
+      metric = query['MetricStat']['Metric']
+      assert metric['Namespace'] == self.region
+      series_index = int(metric['Dimensions'][0]['Value'])
+      timestamps = [StartTime + timedelta(seconds=period * step) for step in range(num_steps)]
+      results.append({
+        'Id': query['Id'],
+        'Timestamps': timestamps,
+        'Values': [series_index * 1000000 + (t - START_TIME).total_seconds() / period for t in timestamps],
+        'StatusCode': 'Complete',
+      })
+    if self.page_size is None:
+      return {'MetricDataResults': results}
+    page = int(NextToken or 0)
+    resp = {'MetricDataResults': results[page * self.page_size:(page + 1) * self.page_size]}
+    if (page + 1) * self.page_size < len(results):
+      resp['NextToken'] = str(page + 1)
+    return resp
+
+
+def make_series(num_series, region=None):
+  return [{
+    'widget': 'widget',
+    'namespace': region or 'us-east-1',
+    'metric_name': 'metric',
+    'dimensions': {'index': str(i)},
+    'stat': 'Average',
+    'label': f'series {i}',
+    'region': region,
+    'account': None,
+  } for i in range(num_series)]
+
+
+def expected_values(series, num_steps):
+  indexes = np.array([int(s['dimensions']['index']) for s in series], dtype=float)
+  return indexes[:, None] * 1000000 + np.arange(num_steps)[None, :]
+
+
+def test_queries_are_batched_under_the_request_limit():
+  client = StubCloudWatchClient()
+  series = make_series(2 * MAX_QUERIES_PER_REQUEST + 1)
+
+  timestamps, values = fetch_series_matrix(client, series, START_TIME, START_TIME + timedelta(hours=1), period=300)
+
+  assert [len(call['queries']) for call in client.calls] == [MAX_QUERIES_PER_REQUEST, MAX_QUERIES_PER_REQUEST, 1]
+  assert len(timestamps) == 12
+  np.testing.assert_array_equal(values, expected_values(series, 12))
+
+
+def test_next_token_pages_are_followed():
+  client = StubCloudWatchClient(page_size=7)
+  series = make_series(20)
+
+  _, values = fetch_series_matrix(client, series, START_TIME, START_TIME + timedelta(hours=1), period=300)
+
+  assert [call['next_token'] for call in client.calls] == [None, '1', '2']
+  np.testing.assert_array_equal(values, expected_values(series, 12))
+
+
+def test_time_range_is_split_under_the_datapoints_limit():
+  client = StubCloudWatchClient()
+  series = make_series(25)
+  end_time = START_TIME + timedelta(days=7)
+
+  timestamps, values = fetch_series_matrix(client, series, START_TIME, end_time, period=60)
+
+  assert len(client.calls) == 3
+  assert client.calls[0]['start'] == START_TIME
+  assert client.calls[-1]['end'] == end_time
+  assert all(a['end'] == b['start'] for a, b in zip(client.calls, client.calls[1:]))
+  assert len(timestamps) == 7 * 1440
+  np.testing.assert_array_equal(values, expected_values(series, 7 * 1440))
+
+
+def test_series_are_fetched_through_their_region_client():
+  clients = {}
+  def get_cw_client(region):
+    assert region not in clients
+    clients[region] = StubCloudWatchClient(region=region)
+    return clients[region]
+  default_series = make_series(3)
+  other_series = make_series(2, region='us-west-2')
+  # interleave the regions, the rows must come back in the series order
+  series = [default_series[0], other_series[0], default_series[1], other_series[1], default_series[2]]
+
+  _, values = fetch_regional_series_matrix(get_cw_client, series, START_TIME, START_TIME + timedelta(hours=1), period=300)
+
+  assert sorted(clients) == ['us-east-1', 'us-west-2']
+  assert sum(len(call['queries']) for call in clients['us-east-1'].calls) == 3
+  assert sum(len(call['queries']) for call in clients['us-west-2'].calls) == 2
+  np.testing.assert_array_equal(values, expected_values(series, 12))
+
+
+def test_export_round_trips_through_load_export(tmp_path):
+  series = make_series(2) + make_series(1, region='us-west-2')
+  series[0]['dimensions'] = {'index': '0', 'instance': 'i-0123'}
+  series[2]['account'] = '123456789012'
+  output_path = tmp_path / 'export.npz'
+
+  timestamps, values = export_series(lambda region: StubCloudWatchClient(region=region), series,
+                                     START_TIME, START_TIME + timedelta(hours=2), output_path, period=300)
+  export = load_export(output_path)
+
+  np.testing.assert_array_equal(export['timestamps'], timestamps)
+  np.testing.assert_array_equal(export['values'], values)
+  assert int(export['period']) == 300
+  assert export['dimensions'] == [s['dimensions'] for s in series]
+  assert list(export['region']) == ['us-east-1', 'us-east-1', 'us-west-2']
+  assert list(export['account']) == ['', '', '123456789012']
+  for key in ['widget', 'namespace', 'metric_name', 'stat', 'label']:
+    assert list(export[key]) == [s[key] for s in series]
@@ -0,0 +1,92 @@
+import os
+
+import aws_cdk as cdk
+import pytest
+
+from synapse_cloudwatch_dashboard import synapse_cloudwatch_dashboard_stack
+from synapse_cloudwatch_dashboard.synapse_cloudwatch_dashboard_stack import SynapseCloudwatchDashboardStack
+from synapse_cloudwatch_dashboard.synth_cache import SynthCache, configuration_slice
+
+# widgets that do not read the S3 configuration
+CONTEXT = {'stack': 'prod', 'stack_versions': '500,501', 'widgets': 'rds,ses,sqs'}
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+  path = str(tmp_path / 'synth')
+  monkeypatch.setattr(SynthCache, 'DEFAULT_PATH', path)
+  return path
+
+
+def synth(context):
+  app = cdk.App(context=context)
+  SynapseCloudwatchDashboardStack(scope=app, construct_id='SynapseCloudwatchDashboardStack')
+  return app.synth().get_stack_by_name('SynapseCloudwatchDashboardStack').template
+
+
+def cache_entries(cache_path):
+  return sorted(os.listdir(cache_path)) if os.path.exists(cache_path) else []
+
+
+def fail_to_build(*args, **kwargs):
+  raise AssertionError('the dashboard was built on a cache hit')
+
+
+def test_cache_hit_synthesizes_the_same_template(cache_path, monkeypatch):
+  uncached = synth({**CONTEXT, 'synth_cache': 'false'})
+  assert cache_entries(cache_path) == []
+
+  miss = synth(CONTEXT)
+  assert len(cache_entries(cache_path)) == 1
+
+  monkeypatch.setattr(synapse_cloudwatch_dashboard_stack, 'create_dashboard_rows', fail_to_build)
+  hit = synth(CONTEXT)
+
+  assert miss == uncached
+  assert hit == miss
+  assert len(cache_entries(cache_path)) == 1
+
+
+@pytest.mark.parametrize('changed', [
+  {'stack_versions': '500'},
+  {'widgets': 'rds'},
+  {'@aws-cdk/core:newStyleStackSynthesis': False},
+])
+def test_changed_inputs_miss(cache_path, changed):
+  synth(CONTEXT)
+  synth({**CONTEXT, **changed})
+
+  assert len(cache_entries(cache_path)) == 2
+
+
+def test_eviction_keeps_the_most_recent_entries(tmp_path):
+  cache = SynthCache(path=str(tmp_path), max_entries=2)
+  for i in range(3):
+    cache.put(f'key{i}', {'i': i})
+    os.utime(cache.get_entry_path(f'key{i}'), (i, i))
+  # reading an entry marks it as recently used
+  assert cache.get('key1') == {'i': 1}
+  cache.put('key3', {'i': 3})
+
+  assert cache.get('key0') is None
+  assert cache.get('key2') is None
+  assert cache.get('key1') == {'i': 1}
+  assert cache.get('key3') == {'i': 3}
+
+
+def test_configuration_slice_keeps_the_entries_of_the_stack_versions():
+  config = {
+    '500-repo-vmids': ['a'],
+    '5000-repo-vmids': ['b'],
+    '501-repo-vmids': ['c'],
+    '222/us-west-2/500-repo-vmids': ['d'],
+    'primary-target': {'account': '111', 'region': 'us-east-1'},
+    'discovery-targets': [{'account': '222', 'region': 'us-west-2'}],
+  }
+
+  assert configuration_slice(config, ['500']) == {
+    '500-repo-vmids': ['a'],
+    '222/us-west-2/500-repo-vmids': ['d'],
+    'primary-target': {'account': '111', 'region': 'us-east-1'},
+    'discovery-targets': [{'account': '222', 'region': 'us-west-2'}],
+  }
@@ -0,0 +1,58 @@
+import pytest
+
+from synapse_cloudwatch_dashboard.synapse_cloudwatch_dashboard_stack import (
+  WIDGET_FACTORIES, WIDGET_REGISTRY, DASHBOARD_LAYOUT, WidgetFactory, check_dashboard_layout, parse_widget_selection,
+  selection_needs_config, create_dashboard_rows, configuration_not_loaded
+)
+
+
+def test_every_factory_is_in_the_layout_once():
+  check_dashboard_layout(DASHBOARD_LAYOUT, WIDGET_FACTORIES)
+
+  assert sorted(name for row_names in DASHBOARD_LAYOUT for name in row_names) == sorted(WIDGET_REGISTRY)
+
+
+@pytest.mark.parametrize('layout', [
+  [['a']],
+  [['a', 'b'], ['c']],
+  [['a'], ['b', 'a']],
+])
+def test_inconsistent_layouts_are_rejected(layout):
+  factories = [WidgetFactory(name, [], build=None) for name in ['a', 'b']]
+
+  with pytest.raises(ValueError):
+    check_dashboard_layout(layout, factories)
+
+
+def test_widget_selection():
+  assert parse_widget_selection(None) is None
+  assert parse_widget_selection(' rds , ses,') == {'rds', 'ses'}
+  with pytest.raises(ValueError):
+    parse_widget_selection('rds,unknown')
+
+
+@pytest.mark.parametrize('selection_str', ['', ',', ' , '])
+def test_empty_widget_selection_is_rejected(selection_str):
+  with pytest.raises(ValueError):
+    parse_widget_selection(selection_str)
+
+
+def test_selection_builds_the_selected_widgets_in_layout_order():
+  selection = parse_widget_selection('ses,rds-cpu,docker,repo-alb-v1')
+
+  rows = create_dashboard_rows(stack='prod', stack_versions=['500'], load_config=lambda: {}, selection=selection)
+
+  assert [len(row) for row in rows] == [1, 2, 1, 1]
+  assert selection_needs_config(selection)
+  # repo-alb-v1 reads the configuration, the others do not
+  assert not selection_needs_config(parse_widget_selection('rds,docker,ses'))
+
+
+def test_reading_a_configuration_that_was_not_loaded_fails(monkeypatch):
+  # a factory reading the configuration without needs_config=True
+  monkeypatch.setitem(WIDGET_REGISTRY, 'ses', WidgetFactory('ses', ['ses'], build=lambda ctx: ctx.get_config()))
+  selection = parse_widget_selection('ses')
+  assert not selection_needs_config(selection)
+
+  with pytest.raises(ValueError):
+    create_dashboard_rows(stack='prod', stack_versions=['500'], load_config=configuration_not_loaded, selection=selection)